@@ -47,5 +47,10 @@ setup(name='DataSounds',
       zip_safe=False,
       install_requires=install_requires,
       cmdclass={'test': PyTest},
+      entry_points={
+          'console_scripts': [
+              'datasounds = DataSounds.cli:main',
+          ],
+      },
       platforms='any',
       )
@@ -0,0 +1,315 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Command line entry point to render batches of data files to MIDI.
+
+Exit codes are meant to be checked by cron or batch schedulers:
+
+    0  every input was rendered or was already up to date
+    1  at least one input failed to render
+    2  bad command line usage
+    3  no input files were found
+'''
+from __future__ import print_function
+
+import argparse
+import glob
+import hashlib
+import multiprocessing
+import os
+import stat
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from DataSounds.sounds import get_music
+
+
+EXIT_OK = 0
+EXIT_FAILURE = 1
+EXIT_USAGE = 2
+EXIT_NOINPUT = 3
+
+EXTENSIONS = ('.npy', '.csv')
+OUTPUT_EXTENSION = '.midi'
+HASH_EXTENSION = '.sha1'
+OPTIONS_EXTENSION = '.options'
+
+_replace = getattr(os, 'replace', os.rename)
+
+
+def find_inputs(paths):
+    '''
+    Expand directories and glob patterns into a sorted list of input files.
+
+    Parameters
+    ----------
+    paths : list of str
+        Files, directories (searched non recursively) or glob patterns.
+
+    Returns
+    -------
+    inputs : list of str
+        Files with a supported extension ('.npy' or '.csv').
+    '''
+    found = set()
+    for path in paths:
+        if os.path.isdir(path):
+            candidates = [os.path.join(path, name)
+                          for name in os.listdir(path)]
+        else:
+            candidates = glob.glob(path)
+        for candidate in candidates:
+            if (os.path.isfile(candidate) and
+                    os.path.splitext(candidate)[1].lower() in EXTENSIONS):
+                found.add(candidate)
+    return sorted(found)
+
+
+def load_series(path):
+    '''
+    Load a series from a '.npy' or numeric '.csv' file.
+
+    CSV columns are taken as series, so a file with two columns is
+    rendered as two tracks. Inputs without any numeric value (e.g. a CSV
+    of text, which reads as NaN) raise a ValueError instead of rendering
+    silence.
+    '''
+    if path.lower().endswith('.npy'):
+        series = np.load(path)
+    else:
+        series = np.genfromtxt(path, delimiter=',')
+        if series.ndim == 2:
+            series = series.T
+    if not np.isfinite(np.asarray(series, dtype='f8')).any():
+        raise ValueError("%s has no numeric values" % path)
+    return series
+
+
+def output_path(path, output_dir=None):
+    stem = os.path.splitext(os.path.basename(path))[0]
+    if output_dir is None:
+        output_dir = os.path.dirname(path)
+    return os.path.join(output_dir, stem + OUTPUT_EXTENSION)
+
+
+def options_digest(options):
+    '''
+    Hash of the options used to render a file.
+    '''
+    return hashlib.sha1(repr(sorted(options.items())).encode('utf-8'))
+
+
+def input_digest(path, options):
+    '''
+    Content hash of an input file and the options used to render it.
+    '''
+    digest = options_digest(options)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def read_digest(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except (IOError, OSError):
+        return None
+
+
+def is_up_to_date(path, target, check='mtime', options=None):
+    '''
+    Check if `target` was already rendered from the current `path` with
+    the same options.
+
+    Parameters
+    ----------
+    check : str
+        'mtime' compares modification times and the options hash stored
+        next to the output, 'hash' compares the content hash stored next
+        to the output on the previous run.
+    '''
+    if not os.path.exists(target):
+        return False
+    options = options or {}
+    if check == 'mtime':
+        return (os.path.getmtime(target) >= os.path.getmtime(path) and
+                read_digest(target + OPTIONS_EXTENSION) ==
+                options_digest(options).hexdigest())
+    return read_digest(target + HASH_EXTENSION) == input_digest(path, options)
+
+
+def file_mode(path):
+    '''
+    Permissions of `path`, or the default ones for new files when it
+    doesn't exist.
+    '''
+    try:
+        return stat.S_IMODE(os.stat(path).st_mode)
+    except OSError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
+
+
+def write_atomic(target, data):
+    '''
+    Write `data` to `target` through a temporary file in the same
+    directory, so readers never see a partially written file.
+    '''
+    directory = os.path.dirname(target) or '.'
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.datasounds-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        # mkstemp creates private files: use the mode of the file being
+        # replaced, or the one `open` would give
+        os.chmod(tmp, file_mode(target))
+        _replace(tmp, target)
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def render_file(job):
+    '''
+    Render one input file. Runs inside the worker processes.
+
+    Returns
+    -------
+    result : tuple
+        (path, target, status, samples, seconds, error), where status is
+        one of 'rendered', 'skipped' or 'failed'.
+    '''
+    path, target, options, check, force = job
+    start = time.time()
+    try:
+        if not force and is_up_to_date(path, target, check, options):
+            return path, target, 'skipped', 0, time.time() - start, None
+
+        series = load_series(path)
+        midi = get_music(series, **options)
+        write_atomic(target, midi.getvalue())
+        if check == 'hash':
+            write_atomic(target + HASH_EXTENSION,
+                         input_digest(path, options).encode('ascii'))
+        else:
+            write_atomic(target + OPTIONS_EXTENSION,
+                         options_digest(options).hexdigest().encode('ascii'))
+        return (path, target, 'rendered', series.size,
+                time.time() - start, None)
+    except Exception as e:
+        return path, target, 'failed', 0, time.time() - start, str(e)
+
+
+def _int_list(value):
+    try:
+        return [int(v) for v in value.split(',')]
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "expected comma separated integers, got '%s'" % value)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='datasounds',
+        description='Render .npy/.csv data files to MIDI.')
+    parser.add_argument('inputs', nargs='+',
+                        help='input files, directories or glob patterns')
+    parser.add_argument('-o', '--output-dir', default=None,
+                        help='directory for the .midi files '
+                             '(default: next to each input)')
+    parser.add_argument('-j', '--jobs', type=int,
+                        default=multiprocessing.cpu_count(),
+                        help='number of worker processes (default: %(default)s)')
+    parser.add_argument('--check', choices=('mtime', 'hash'), default='mtime',
+                        help='how to detect up to date outputs '
+                             '(default: %(default)s)')
+    parser.add_argument('-f', '--force', action='store_true',
+                        help='render even if outputs are up to date')
+    parser.add_argument('--key', default='C', help='musical key')
+    parser.add_argument('--mode', default='major',
+                        choices=('major', 'minor', 'pentatonic', 'blues'),
+                        help='musical mode')
+    parser.add_argument('--octaves', type=_int_list, default=[2],
+                        help='octaves, one value or one per series')
+    parser.add_argument('--instruments', type=_int_list, default=None,
+                        help='comma separated MIDI programs, one per series')
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help='only print failures and the summary')
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    if args.jobs < 1:
+        parser.error('--jobs must be at least 1')
+
+    inputs = find_inputs(args.inputs)
+    if not inputs:
+        print('datasounds: no .npy or .csv inputs found', file=sys.stderr)
+        return EXIT_NOINPUT
+
+    octaves = args.octaves[0] if len(args.octaves) == 1 else args.octaves
+    options = {'key': args.key, 'mode': args.mode, 'octaves': octaves,
+               'instruments': args.instruments}
+    jobs = [(path, output_path(path, args.output_dir), options,
+             args.check, args.force) for path in inputs]
+
+    # inputs with the same name would overwrite each other's output
+    sources = {}
+    for path, target, _, _, _ in jobs:
+        sources.setdefault(target, []).append(path)
+    clashes = sorted((target, paths) for target, paths in sources.items()
+                     if len(paths) > 1)
+    for target, paths in clashes:
+        print('datasounds: %s would all be written to %s' % (
+            ', '.join(paths), target), file=sys.stderr)
+    if clashes:
+        return EXIT_USAGE
+
+    if args.output_dir is not None and not os.path.isdir(args.output_dir):
+        os.makedirs(args.output_dir)
+
+    start = time.time()
+    if args.jobs == 1 or len(jobs) == 1:
+        results = map(render_file, jobs)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(min(args.jobs, len(jobs)))
+        results = pool.imap_unordered(render_file, jobs)
+
+    counts = {'rendered': 0, 'skipped': 0, 'failed': 0}
+    samples = 0
+    try:
+        for path, target, status, size, seconds, error in results:
+            counts[status] += 1
+            samples += size
+            if status == 'failed':
+                print('FAILED %s: %s' % (path, error), file=sys.stderr)
+            elif not args.quiet:
+                print('%-8s %s -> %s (%.3f s)' % (status, path, target,
+                                                  seconds))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    elapsed = max(time.time() - start, 1e-9)
+    print('%d rendered, %d skipped, %d failed in %.2f s '
+          '(%.1f files/s, %.0f samples/s)' % (
+              counts['rendered'], counts['skipped'], counts['failed'],
+              elapsed, counts['rendered'] / elapsed, samples / elapsed))
+
+    return EXIT_FAILURE if counts['failed'] else EXIT_OK
+
+
+if __name__ == '__main__':
+    sys.exit(main())
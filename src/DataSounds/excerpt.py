@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Excerpts of rendered MIDI files, read through their tick index.
+
+`SMF.write` (and `get_music`) can save an index next to a MIDI file, with
+the byte position and absolute tick of every Nth note message of each
+track. `excerpt` maps the MIDI file with `mmap`, jumps to the indexed
+message before the excerpt start in each track and decodes only from
+there, so the cost follows the excerpt length rather than the file size.
+
+Example
+-------
+>>> with open('long.midi', 'wb') as f:
+...     f.write(get_music(data, index=index_path('long.midi')).getvalue())
+>>> part = excerpt('long.midi', 600, 720, seconds=True)
+'''
+
+from io import BytesIO
+import mmap
+import struct
+
+import numpy as np
+
+from DataSounds.external.sebastian.midi.write_midi import (
+    Thd, Trk, write_varlen)
+
+
+INDEX_SUFFIX = '.index.npz'
+
+
+def index_path(path):
+    '''
+    Default name of the index of a MIDI file.
+    '''
+    return path + INDEX_SUFFIX
+
+
+def load_index(path):
+    '''
+    Load an index saved by `SMF.write` as a dict of arrays.
+    '''
+    with np.load(path) as data:
+        return dict((name, data[name]) for name in data.files)
+
+
+def seconds_to_ticks(seconds, index):
+    '''
+    Convert seconds from the start of an indexed file to ticks.
+    '''
+    return int(round(seconds * 1e6 / int(index['tempo']) *
+                     int(index['division'])))
+
+
+def _byte(data, pos):
+    return ord(data[pos:pos + 1])
+
+
+def read_varlen(data, pos):
+    '''
+    Decode the variable length quantity at `pos`, returning it and the
+    position that follows.
+    '''
+    value = 0
+    while True:
+        byte = _byte(data, pos)
+        pos += 1
+        value = (value << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            return value, pos
+
+
+def track_excerpt(data, bounds, entries, start, end):
+    '''
+    Track with the notes of an indexed track starting in [start, end).
+
+    The preamble of the track (meta events and program changes before its
+    notes) is copied, programs set before `start` are set again at the
+    beginning, and notes still sounding at `end` are switched off there.
+
+    Parameters
+    ----------
+    data : mmap or bytes
+        the whole MIDI file.
+    bounds : tuple of int
+        positions where the track data, its note messages and the track
+        end in the file.
+    entries : tuple of arr
+        (position, tick, programs) of the index entries of the track.
+    '''
+    track_start, events_start, track_end = bounds
+    positions, ticks, programs = entries
+
+    t = Trk()
+    t.data.write(data[track_start:events_start])
+
+    k = np.searchsorted(ticks, start, side='left') - 1
+    if k >= 0:
+        for channel, program in enumerate(programs[k]):
+            if program >= 0:
+                t.program_change(channel, int(program))
+        pos = int(positions[k])
+        # the entry tick is the one of its message, after the delta
+        tick = int(ticks[k]) - read_varlen(data, pos)[0]
+    else:
+        pos = events_start
+        tick = 0
+
+    last = start
+    active = {}
+    while pos < track_end:
+        delta, pos = read_varlen(data, pos)
+        tick += delta
+        status = _byte(data, pos)
+        if status == 0xFF:
+            if _byte(data, pos + 1) == 0x2F:
+                break
+            size, pos = read_varlen(data, pos + 2)
+            pos += size
+            continue
+        if tick >= end:
+            break
+
+        kind = status & 0xF0
+        size = 2 if kind in (0xC0, 0xD0) else 3
+        message = data[pos:pos + size]
+        pos += size
+        if kind in (0x80, 0x90):
+            note = (status & 0x0F, _byte(message, 1))
+            if kind == 0x90 and _byte(message, 2):
+                if tick < start:
+                    continue
+                active[note] = active.get(note, 0) + 1
+            elif active.get(note):
+                active[note] -= 1
+            else:
+                # switching off a note started before the excerpt
+                continue
+
+        at = max(tick, start)
+        write_varlen(t.data, at - last)
+        t.data.write(message)
+        last = at
+
+    for (channel, pitch), count in sorted(active.items()):
+        for _ in range(count):
+            t.end_note(end - last, channel, pitch)
+            last = end
+    t.track_end()
+    return t
+
+
+def excerpt(path, start, end, index=None, seconds=False):
+    '''
+    Standalone MIDI file with the notes of an indexed file starting
+    between `start` and `end`.
+
+    Parameters
+    ----------
+    path : str
+        MIDI file written with an index.
+    start, end : int or float
+        excerpt range, in ticks, or in seconds with `seconds=True`.
+    index : str or dict, optional
+        index file name or loaded index, `index_path(path)` by default.
+
+    Returns
+    -------
+    midi_out : BytesIO object.
+        MIDI file of the same format and resolution, starting at `start`.
+    '''
+    if index is None:
+        index = index_path(path)
+    if not isinstance(index, dict):
+        index = load_index(index)
+    if seconds:
+        start = seconds_to_ticks(start, index)
+        end = seconds_to_ticks(end, index)
+    if end <= start:
+        raise ValueError("excerpt end must come after its start")
+
+    midi_out = BytesIO()
+    with open(path, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if data[:4] != b'MThd':
+                raise ValueError("%s is not a MIDI file" % path)
+            midi_format, _, division = struct.unpack('>HHH', data[8:14])
+            bounds = index['bounds']
+            Thd(midi_format, len(bounds), division).write(midi_out)
+            for i, track_bounds in enumerate(bounds):
+                selected = index['track'] == i
+                entries = (index['position'][selected],
+                           index['tick'][selected],
+                           index['programs'][selected])
+                track_excerpt(data, [int(b) for b in track_bounds], entries,
+                              start, end).write(midi_out)
+        finally:
+            data.close()
+    return midi_out
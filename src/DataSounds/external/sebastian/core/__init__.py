@@ -19,7 +19,7 @@ MIDI_PITCH = "midi_pitch"
 DURATION_64 = "duration_64"
 DEGREE = 'degree'
 
-from .elements import OSeq, Point, VSeq, HSeq  # noqa
+from .elements import OSeq, Point, VSeq, HSeq, display_all  # noqa
 
 OSequence = OSeq(OFFSET_64, DURATION_64)
 
@@ -1,6 +1,7 @@
-from collections import Iterable
-import tempfile
-import subprocess as sp
+try:
+    from collections.abc import Iterable
+except ImportError:
+    from collections import Iterable
 
 try:
     from IPython.core.display import Image, SVG
@@ -8,7 +9,7 @@ try:
 except ImportError:
     ipython = False
 
-from ..lilypond import write_lilypond
+from ..lilypond import render, write_lilypond
 
 
 class UnificationError(Exception):
@@ -81,63 +82,71 @@ class SeqBase(object):
     __or__ = transform
     __and__ = zip
 
+    def _lily_source(self):
+        from .transforms import lilypond
+        seq = HSeq(self) | lilypond()
+        return write_lilypond.lily_format(seq)
+
     def display(self, format="png"):
         """
         Return an object that can be used to display this sequence.
         This is used for IPython Notebook.
 
+        Renderings are cached on disk, see `lilypond.render`.
+
         :param format: "png" or "svg"
         """
-        from .core.transforms import lilypond
-        seq = HSeq(self) | lilypond()
-
-        lily_output = write_lilypond.lily_format(seq)
+        lily_output = self._lily_source()
         if not lily_output.strip():
             #In the case of empty lily outputs, return self to get a textual display
             return self
-
-        if format == "png":
-            suffix = ".preview.png"
-            args = ["lilypond", "--png", "-dno-print-pages", "-dpreview"]
-        elif format == "svg":
-            suffix = ".preview.svg"
-            args = ["lilypond", "-dbackend=svg", "-dno-print-pages", "-dpreview"]
-
-        f = tempfile.NamedTemporaryFile(suffix=suffix)
-        basename = f.name[:-len(suffix)]
-        args.extend(["-o" + basename, "-"])
-
-        #Pass shell=True so that if your $PATH contains ~ it will
-        #get expanded. This also changes the way the arguments get
-        #passed in. To work correctly, pass them as a string
-        p = sp.Popen(" ".join(args), stdin=sp.PIPE, shell=True)
-        stdout, stderr = p.communicate("{ %s }" % lily_output)
-        if p.returncode != 0:
-            # there was an error
-            #raise IOError("Lilypond execution failed: %s%s" % (stdout, stderr))
-            return None
-
-        if not ipython:
-            return f.read()
-        if format == "png":
-            return Image(data=f.read(), filename=f.name, format="png")
-        else:
-            return SVG(data=f.read(), filename=f.name)
+        return _display_object(render.render("{ %s }" % lily_output, format),
+                               format)
 
     def __repr__(self):
         return "%s(%r)" % (self.__class__.__name__, self._elements)
 
     def _repr_png_(self):
-        f = self.display("png")
-        if not isinstance(f, basestring):
-            return f.data
-        return f
+        return _repr_data(self.display("png"))
 
     def _repr_svg_(self):
-        f = self.display("svg")
-        if not isinstance(f, basestring):
-            return f.data
+        return _repr_data(self.display("svg"))
+
+
+def _repr_data(f):
+    # empty sequences display as themselves: IPython then falls back to
+    # their textual repr
+    if f is None or isinstance(f, SeqBase):
+        return None
+    if isinstance(f, bytes):
         return f
+    return f.data
+
+
+def _display_object(data, format):
+    if data is None or not ipython:
+        return data
+    if format == "png":
+        return Image(data=data, format="png")
+    else:
+        return SVG(data=data)
+
+
+def display_all(seqs, format="png", max_workers=None):
+    """
+    Display several sequences, running lilypond for them concurrently.
+
+    :param format: "png" or "svg"
+    :param max_workers: number of lilypond processes run at once
+    """
+    sources = [seq._lily_source() for seq in seqs]
+    todo = [i for i, source in enumerate(sources) if source.strip()]
+    rendered = render.render_many(["{ %s }" % sources[i] for i in todo],
+                                  format, max_workers=max_workers)
+    results = list(seqs)
+    for i, data in zip(todo, rendered):
+        results[i] = _display_object(data, format)
+    return results
 
 
 def OSeq(offset_attr, duration_attr):
@@ -208,7 +217,7 @@ def OSeq(offset_attr, duration_attr):
                     if end_offset is None or point[offset_attr] < end_offset:
                         yield point
                     else:
-                        raise StopIteration
+                        return
             return _OSeq(subseq_iter(start_offset, end_offset))
 
         __add__ = concatenate
@@ -269,7 +278,7 @@ class HSeq(SeqBase):
                 if end_offset is None or cur_offset < end_offset:
                     yield point
                 else:
-                    raise StopIteration
+                    return
         return HSeq(subseq_iter(start_offset, end_offset))
 
     __add__ = concatenate
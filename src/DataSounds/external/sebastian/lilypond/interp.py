@@ -51,7 +51,7 @@ def tokenize(s):
                 raise Exception("unknown token at: '%s'" % s[:20])
             s = s[m.end():]
         else:
-            raise StopIteration
+            return
 
 
 def note_tuple(token_dict, relative_note_tuple=None):
@@ -228,7 +228,7 @@ def parse_block(token_generator, prev_note_tuple=None, relative_mode=False, offs
                 prev_duration = duration
     except StopIteration:
         yield Point({OFFSET_64: offset})
-        raise StopIteration
+        return
 
 
 def parse(s, offset=0):
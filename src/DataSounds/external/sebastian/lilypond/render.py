@@ -0,0 +1,172 @@
+"""
+Run lilypond to render sequences as PNG or SVG, with an on-disk cache.
+
+Renderings are cached by a hash of the lilypond source and the output
+format, so displaying an unchanged sequence again doesn't start lilypond.
+The cache directory is bounded in size, evicting the least recently used
+files first.
+"""
+
+import hashlib
+import os
+import shutil
+import subprocess as sp
+import tempfile
+from multiprocessing.pool import ThreadPool
+
+try:
+    from shlex import quote
+except ImportError:
+    from pipes import quote
+
+
+# command used to run lilypond; it goes through the shell so that a
+# $PATH containing ~ gets expanded
+LILYPOND = os.environ.get("LILYPOND", "lilypond")
+
+CACHE_DIR = os.environ.get(
+    "DATASOUNDS_LILYPOND_CACHE",
+    os.path.join(os.path.expanduser("~"), ".cache", "datasounds", "lilypond"))
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+FORMATS = {
+    "png": (".preview.png", ["--png", "-dno-print-pages", "-dpreview"]),
+    "svg": (".preview.svg", ["-dbackend=svg", "-dno-print-pages", "-dpreview"]),
+}
+
+
+class RenderCache(object):
+    """
+    Directory of rendered files named by content hash, with LRU eviction
+    once it grows beyond `max_bytes`.
+    """
+
+    def __init__(self, directory=None, max_bytes=None):
+        self.directory = directory or CACHE_DIR
+        self.max_bytes = CACHE_MAX_BYTES if max_bytes is None else max_bytes
+
+    def key(self, source, format):
+        digest = hashlib.sha1()
+        for part in (LILYPOND, format, source):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def path(self, key, format):
+        return os.path.join(self.directory, key + "." + format)
+
+    def get(self, key, format):
+        path = self.path(key, format)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except (IOError, OSError):
+            return None
+        try:
+            # mark as recently used
+            os.utime(path, None)
+        except OSError:
+            pass
+        return data
+
+    def put(self, key, format, data):
+        if not os.path.isdir(self.directory):
+            try:
+                os.makedirs(self.directory)
+            except OSError:
+                if not os.path.isdir(self.directory):
+                    raise
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.rename(tmp, self.path(key, format))
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".tmp"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+
+def run_lilypond(source, format="png"):
+    """
+    Render lilypond `source` to `format`, returning the file content or
+    None if lilypond failed.
+    """
+    suffix, options = FORMATS[format]
+    directory = tempfile.mkdtemp()
+    try:
+        basename = os.path.join(directory, "seq")
+        command = " ".join([LILYPOND] + options + ["-o" + quote(basename), "-"])
+        p = sp.Popen(command, stdin=sp.PIPE, stdout=sp.PIPE, stderr=sp.PIPE,
+                     shell=True)
+        p.communicate(source.encode("utf-8"))
+        if p.returncode != 0:
+            return None
+        try:
+            with open(basename + suffix, "rb") as f:
+                return f.read()
+        except (IOError, OSError):
+            return None
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def render(source, format="png", cache=None):
+    """
+    Render lilypond `source` to `format` ("png" or "svg"), using the cache.
+    Failed renderings return None and aren't cached.
+    """
+    if format not in FORMATS:
+        raise ValueError("format must be one of %s" % sorted(FORMATS))
+    cache = cache or RenderCache()
+    key = cache.key(source, format)
+    data = cache.get(key, format)
+    if data is None:
+        data = run_lilypond(source, format)
+        if data is not None:
+            cache.put(key, format, data)
+    return data
+
+
+def render_many(sources, format="png", cache=None, max_workers=None):
+    """
+    Render several lilypond sources concurrently, in order. Repeated
+    sources are rendered once.
+    """
+    cache = cache or RenderCache()
+    unique = []
+    seen = set()
+    for source in sources:
+        if source not in seen:
+            seen.add(source)
+            unique.append(source)
+    if len(unique) <= 1:
+        rendered = [render(source, format, cache) for source in unique]
+    else:
+        pool = ThreadPool(max_workers or min(len(unique), 8))
+        try:
+            rendered = pool.map(lambda source: render(source, format, cache),
+                                unique)
+        finally:
+            pool.close()
+            pool.join()
+    results = dict(zip(unique, rendered))
+    return [results[source] for source in sources]
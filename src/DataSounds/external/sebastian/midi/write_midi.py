@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 
 from io import BytesIO
+import numpy as np
 import six
 
 from ..core import OFFSET_64, MIDI_PITCH, DURATION_64
@@ -37,6 +38,312 @@ def write_varlen(out, n):
     out.write(data)
 
 
+def track_columns(track):
+    """
+    Return (offset, pitch, duration, velocity, program) arrays for the notes
+    of a track. Tracks exposing a `columns` method (like
+    `DataSounds.notearray.NoteArray`) are used as is, sequences of points
+    are converted; points without a pitch are skipped.
+    """
+    if hasattr(track, 'columns'):
+        return track.columns()
+
+    offsets, pitches, durations, velocities, programs = [], [], [], [], []
+    for point in track:
+        offset, note_value, duration = point.tuple(OFFSET_64, MIDI_PITCH, DURATION_64)
+        if note_value is None:
+            continue
+        offsets.append(offset)
+        pitches.append(note_value)
+        durations.append(duration)
+        velocities.append(64 if 'velocity' not in point else point['velocity'])
+        programs.append(point.get('program'))
+    if any(program is not None for program in programs):
+        programs = np.array(programs)
+    else:
+        programs = None
+    return (np.array(offsets, dtype='i8'), np.array(pitches, dtype='i8'),
+            np.array(durations, dtype='i8'), np.array(velocities, dtype='i8'),
+            programs)
+
+
+# channel 9 is reserved for percussion in General MIDI
+PERCUSSION_CHANNEL = 9
+MELODIC_CHANNELS = [c for c in range(16) if c != PERCUSSION_CHANNEL]
+
+
+def allocate_channels(keys, channels=MELODIC_CHANNELS):
+    """
+    Pack tracks into MIDI channels.
+
+    `keys` identifies the instrument of each track. While there are enough
+    channels every track gets its own; otherwise tracks with the same key
+    share a channel, and keys are spread round-robin when there are more
+    of them than channels.
+
+    Returns the channel of each track and the set of channels shared by
+    different keys, where program changes must be re-issued.
+
+    Tracks sharing a channel also share its notes: in format 0 note offs
+    are merged before the note ons of the same tick (see `merge_events`),
+    but in format 1 a note off of one track may still end a note of the
+    same pitch another track starts at that tick, depending on how the
+    player orders simultaneous events of different tracks.
+    """
+    if len(keys) <= len(channels):
+        return [channels[i] for i in range(len(keys))], set()
+
+    slots = {}
+    for key in keys:
+        if key not in slots:
+            slots[key] = len(slots)
+    assigned = [channels[slots[key] % len(channels)] for key in keys]
+
+    owners = {}
+    for key, channel in zip(keys, assigned):
+        owners.setdefault(channel, set()).add(key)
+    shared = set(channel for channel, k in owners.items() if len(k) > 1)
+    return assigned, shared
+
+
+def track_events(columns, channel, instrument):
+    """
+    Schedule the note on/off events of a track.
+
+    Returns (tick, on, channel, pitch, velocity, program) arrays in time
+    order. Note ons are already in offset order and note offs are the same
+    notes shifted by their durations, so a stable sort on the interleaved
+    integer ticks merges both runs and keeps simultaneous events in note
+    order: the note off of an earlier note comes before the next note on,
+    and a zero length note is switched on before it is switched off.
+    """
+    offsets, pitches, durations, velocities, programs = columns
+    n = len(offsets)
+
+    ticks = np.empty(2 * n, dtype='i8')
+    ticks[0::2] = offsets
+    ticks[1::2] = np.asarray(offsets) + durations
+    on = np.zeros(2 * n, dtype=bool)
+    on[0::2] = True
+    if programs is None:
+        programs = np.zeros(n, dtype='i8') + instrument
+
+    order = np.argsort(ticks, kind='mergesort')
+    return (ticks[order], on[order],
+            np.zeros(2 * n, dtype='i8')[order] + channel,
+            np.repeat(np.asarray(pitches, dtype='i8'), 2)[order],
+            np.repeat(np.asarray(velocities, dtype='i8'), 2)[order],
+            np.repeat(np.asarray(programs, dtype='i8'), 2)[order])
+
+
+def event_ranks(events):
+    """
+    Order of the events of a track among simultaneous events of other
+    tracks: note offs (0), note ons (1), then the note offs of zero length
+    notes (2), which `track_events` puts right after their own note on.
+    """
+    ticks, on, channel, pitch = events[:4]
+    ranks = on.astype('i8')
+    zero = np.zeros(len(ticks), dtype=bool)
+    zero[1:] = (~on[1:] & on[:-1] & (ticks[1:] == ticks[:-1]) &
+                (channel[1:] == channel[:-1]) & (pitch[1:] == pitch[:-1]))
+    ranks[zero] = 2
+    return ranks
+
+
+def merge_events(events):
+    """
+    Merge the time ordered events of several tracks. At a given tick every
+    note off comes before the note ons, so a track sharing a channel can't
+    switch off a note another track has just started; simultaneous events
+    otherwise keep the track order.
+    """
+    ranks = np.concatenate([event_ranks(track) for track in events])
+    columns = [np.concatenate(column) for column in zip(*events)]
+    order = np.lexsort((ranks, columns[0]))
+    return tuple(column[order] for column in columns)
+
+
+def varlen_sizes(values):
+    """
+    Number of bytes of the MIDI variable length quantity of each value.
+    """
+    values = np.asarray(values, dtype='i8')
+    return 1 + sum((values >= (1 << (7 * k))).astype('i8') for k in range(1, 4))
+
+
+def fill_varlen(data, starts, values, sizes):
+    """
+    Write variable length quantities into `data` at `starts`.
+    """
+    for k in range(4):
+        selected = sizes > k
+        shift = 7 * (sizes[selected] - 1 - k)
+        byte = (values[selected] >> shift) & 0x7F
+        byte |= np.where(k < sizes[selected] - 1, 0x80, 0)
+        data[starts[selected] + k] = byte
+
+
+def encode_events(events, programs, force=()):
+    """
+    Encode scheduled events as MIDI track data, computing every time delta
+    at once. A program change is issued before a note on when its channel
+    is set to another program, or always for channels in `force`.
+    `programs` holds the program each channel starts with.
+    """
+    return encode_messages(events, programs, force)[0]
+
+
+def encode_messages(events, programs, force=()):
+    """
+    Like `encode_events`, but also returns the byte position in the data,
+    absolute tick, status and first data byte of every message written.
+    """
+    ticks, on, channel, pitch, velocity, program = events
+    n = len(ticks)
+    if not n:
+        empty = np.zeros(0, dtype='i8')
+        return b"", empty, empty, empty, empty
+    deltas = np.diff(np.concatenate([[0], ticks]))
+
+    # program changes: compare each note on with the previous one on the
+    # same channel, or with the starting program of the channel
+    on_index = np.nonzero(on)[0]
+    by_channel = np.argsort(channel[on_index], kind='mergesort')
+    ch = channel[on_index][by_channel]
+    pr = program[on_index][by_channel]
+    previous = np.empty_like(pr)
+    previous[1:] = pr[:-1]
+    first = np.ones(len(ch), dtype=bool)
+    first[1:] = ch[1:] != ch[:-1]
+    previous[first] = [programs.get(c, -1) for c in ch[first]]
+    changed = pr != previous
+    for c in force:
+        changed |= ch == c
+    change = np.zeros(len(ch), dtype=bool)
+    change[by_channel] = changed
+    pc_index = on_index[change]
+
+    # make room for the program changes right before their note ons
+    inserted = np.zeros(n, dtype='i8')
+    inserted[pc_index] = 1
+    position = np.arange(n) + np.cumsum(inserted)
+    pc_position = position[pc_index] - 1
+    m = n + len(pc_index)
+
+    out_deltas = np.zeros(m, dtype='i8')
+    out_deltas[position] = deltas
+    out_deltas[position[pc_index]] = 0
+    out_deltas[pc_position] = deltas[pc_index]
+
+    status = np.zeros(m, dtype='i8')
+    status[position] = np.where(on, 0x90, 0x80) + channel
+    status[pc_position] = 0xC0 + channel[pc_index]
+    data1 = np.zeros(m, dtype='i8')
+    data1[position] = pitch
+    data1[pc_position] = program[pc_index]
+    data2 = np.zeros(m, dtype='i8')
+    # data bytes are 7 bits
+    data2[position] = np.where(on, np.clip(velocity, 0, 127), 0)
+    message_sizes = np.zeros(m, dtype='i8') + 3
+    message_sizes[pc_position] = 2
+
+    delta_sizes = varlen_sizes(out_deltas)
+    sizes = delta_sizes + message_sizes
+    ends = np.cumsum(sizes)
+    starts = ends - sizes
+    data = np.zeros(ends[-1], dtype='u1')
+    fill_varlen(data, starts, out_deltas, delta_sizes)
+    message = starts + delta_sizes
+    data[message] = status
+    data[message + 1] = data1
+    three = message_sizes == 3
+    data[message[three] + 2] = data2[three]
+    return data.tobytes(), starts, np.cumsum(out_deltas), status, data1
+
+
+def index_entries(messages, programs, every):
+    """
+    Index every `every`-th message of encoded track data: (position, tick,
+    programs) arrays, where `programs` holds the program each of the 16
+    channels is set to right before the message (-1 if never set).
+    """
+    _, starts, ticks, status, data1 = messages
+    selected = np.arange(0, len(starts), every)
+    current = np.zeros((len(selected), 16), dtype='i2')
+    for c in range(16):
+        changes = np.nonzero(status == 0xC0 + c)[0]
+        last = np.searchsorted(changes, selected) - 1
+        current[:, c] = np.where(last >= 0,
+                                 data1[changes][np.maximum(last, 0)]
+                                 if len(changes) else -1,
+                                 programs.get(c, -1))
+    return starts[selected], ticks[selected], current
+
+
+def scale_columns(columns, division, track_division=16):
+    """
+    Convert the offsets and durations of track columns from
+    `track_division` to `division` ticks per quarter note.
+    """
+    offsets, pitches, durations, velocities, programs = columns
+    scale = float(division) / track_division
+    if scale != 1:
+        offsets = np.round(np.asarray(offsets) * scale).astype('i8')
+        durations = np.round(np.asarray(durations) * scale).astype('i8')
+    return offsets, pitches, durations, velocities, programs
+
+
+def channel_keys(columns, instruments):
+    """
+    Keys for `allocate_channels`: the instrument of each track, except for
+    tracks changing program along the way, which never share their channel.
+    """
+    return [instrument if track[4] is None else ("track", i)
+            for i, (track, instrument) in enumerate(zip(columns, instruments))]
+
+
+def conductor_track(title, time_signature, key_signature, tempo):
+    """
+    Track with the time/key/tempo info, left open for format 0 files.
+    """
+    t = Trk()
+
+    t0, t1, t2, t3 = time_signature
+    t.time_signature(t0, t1, t2, t3)
+    k0, k1 = key_signature
+    t.key_signature(k0, k1)
+    t.tempo(tempo)
+    t.sequence_track_name(title)
+    return t
+
+
+def note_track(columns, channel, instrument, shared=False, index_every=None):
+    """
+    Track with the notes of `columns` played on `channel`.
+
+    With `index_every`, the track gets an `index` of every Nth note
+    message (see `index_entries`) and the `events_start` of its notes.
+    """
+    t = Trk()
+
+    # set other track attributes here
+    #t.instrument('my instrument')
+
+    # set the instrument this channel is set for
+    t.program_change(channel, instrument)
+
+    # channels shared with other instruments may have been changed
+    # by another track, so programs are set again before each note
+    force = (channel,) if shared else ()
+    t.add_messages(encode_messages(track_events(columns, channel, instrument),
+                                   {channel: instrument}, force),
+                   {channel: instrument}, index_every)
+
+    t.track_end()
+    return t
+
+
 class SMF(object):
 
     def __init__(self, tracks, instruments=None):
@@ -54,63 +361,87 @@ class SMF(object):
         title="untitled",  # distinct from filename
         time_signature=(4, 2, 24, 8),  # (2nd arg is power of 2)
         key_signature = (0, 0),  # C
-        tempo = 500000  # in microseconds per quarter note
+        tempo = 500000,  # in microseconds per quarter note
+        format = 1,  # 0 merges every track into a single one
+        division = 16,  # ticks per quarter note
+        index = None,  # file name or object for a tick index, see below
+        index_every = 64  # note messages between index entries
     ):
-        num_tracks = 1 + len(self.tracks)
-        Thd(format=1, num_tracks=num_tracks, division=16).write(out)
-        T = 1  # how to translate events times into time_delta using the division above
+        """
+        Write the tracks as a MIDI file to `out`.
+
+        When `index` is given, the byte position and absolute tick of every
+        `index_every`-th note message of each track, with the programs set
+        at that point, are saved there with `np.savez`, so excerpts of the
+        file can be read without parsing it all (see `DataSounds.excerpt`).
+        """
+        # sequences are in 64th notes, i.e. 16 ticks per quarter note; tracks
+        # with another `division` are scaled to the one of the file
+        columns = [scale_columns(track_columns(track), division,
+                                 getattr(track, 'division', 16))
+                   for track in self.tracks]
+        channels, shared = allocate_channels(channel_keys(columns, self.instruments))
+
+        every = index_every if index is not None else None
+        if format == 0:
+            Thd(format=0, num_tracks=1, division=division).write(out)
+        else:
+            Thd(format=1, num_tracks=1 + len(self.tracks), division=division).write(out)
 
         # first track will just contain time/key/tempo info
-        t = Trk()
-
-        t0, t1, t2, t3 = time_signature
-        t.time_signature(t0, t1, t2, t3)
-        k0, k1 = key_signature
-        t.key_signature(k0, k1)
-        t.tempo(tempo)
-        t.sequence_track_name(title)
-
+        t = conductor_track(title, time_signature, key_signature, tempo)
+
+        if format == 0:
+            # a single track with every event, programs set as needed
+            events = merge_events([track_events(track, channel, instrument)
+                                   for track, channel, instrument
+                                   in zip(columns, channels, self.instruments)])
+            t.add_messages(encode_messages(events, {}), {}, every)
+            written = [t]
+        else:
+            written = [t]
+            # each track is written to its allocated channel
+            for track, channel, instrument in zip(columns, channels, self.instruments):
+                written.append(note_track(track, channel, instrument,
+                                          channel in shared, every))
         t.track_end()
-        t.write(out)
-
-        # each track is written to it's own channel
-        for channel, track in enumerate(self.tracks):
-            t = Trk()
-
-            # set other track attributes here
-            #t.instrument('my instrument')
-
-            # set the instrument this channel is set for
-            t.program_change(channel, self.instruments[channel])
-
-            # we make a list of events including note off events so we can sort by
-            # offset including them (to avoid negative time deltas)
-            # @@@ this may eventually be a feature of sequences rather than this
-            # MIDI library
-
-            events_with_noteoff = []
-            for point in track:
-                offset, note_value, duration = point.tuple(OFFSET_64, MIDI_PITCH, DURATION_64)
-                velocity = 64 if 'velocity' not in point else point['velocity']
-                if note_value is not None:
-                    events_with_noteoff.append((True, offset, note_value, velocity))
-                    events_with_noteoff.append((False, offset + duration, note_value, velocity))
-
-            prev_offset = None
-            for on, offset, note_value, velocity in sorted(events_with_noteoff, key=lambda x: x[1]):
-                if prev_offset is None:
-                    time_delta = 0
-                else:
-                    time_delta = (offset - prev_offset) * T
-                if on:
-                    t.start_note(time_delta, channel, note_value, velocity)
-                else:
-                    t.end_note(time_delta, channel, note_value)
-                prev_offset = offset
-
-            t.track_end()
+
+        for t in written:
             t.write(out)
 
+        if index is not None:
+            write_index(index, written, format, division, tempo)
+
+
+def write_index(index, tracks, format, division, tempo):
+    """
+    Save the index of written tracks, with positions counted from the
+    start of the MIDI file.
+    """
+    bounds = []
+    entries = []
+    position = 14  # MThd chunk
+    for i, t in enumerate(tracks):
+        start = position + 8  # MTrk chunk header
+        size = len(t.data.getvalue())
+        events_start = size - 4 if t.index is None else t.events_start
+        bounds.append((start, start + events_start, start + size))
+        if t.index is not None:
+            positions, ticks, programs = t.index
+            entries.append((np.zeros(len(positions), dtype='i8') + i,
+                            positions + start + events_start, ticks, programs))
+        position = start + size
+
+    if entries:
+        track, position, tick, programs = [np.concatenate(column)
+                                           for column in zip(*entries)]
+    else:
+        track = position = tick = np.zeros(0, dtype='i8')
+        programs = np.zeros((0, 16), dtype='i2')
+    np.savez(index, format=format, division=division, tempo=tempo,
+             bounds=np.array(bounds, dtype='i8').reshape(-1, 3),
+             track=track, position=position, tick=tick, programs=programs)
+
 
 class Thd(object):
 
@@ -131,6 +462,15 @@ class Trk(object):
 
     def __init__(self):
         self.data = BytesIO()
+        self.index = None
+        self.events_start = None
+
+    def add_messages(self, messages, programs, index_every=None):
+        "Append messages from `encode_messages`, indexing them if asked"
+        self.events_start = len(self.data.getvalue())
+        self.data.write(messages[0])
+        if index_every:
+            self.index = index_entries(messages, programs, index_every)
 
     def write_meta_info(self, byte1, byte2, data):
         "Worker method for writing meta info"
@@ -177,8 +517,8 @@ class Trk(object):
         write_byte(self.data, (t >> 8) % 256)
         write_byte(self.data, (t >> 0) % 256)
 
-    def program_change(self, channel, program):
-        write_varlen(self.data, 0)  # tick
+    def program_change(self, channel, program, time_delta=0):
+        write_varlen(self.data, time_delta)
         write_byte(self.data, 0xC0 + channel)
         write_byte(self.data, program)
 
@@ -186,7 +526,7 @@ class Trk(object):
         write_varlen(self.data, time_delta)
         write_byte(self.data, 0x90 + channel)
         write_byte(self.data, note_number)
-        write_byte(self.data, max(min(velocity, 255), 0))  # velocity
+        write_byte(self.data, max(min(velocity, 127), 0))  # velocity
 
     def end_note(self, time_delta, channel, note_number):
         write_varlen(self.data, time_delta)
@@ -208,7 +548,7 @@ class Trk(object):
 
 
 def write(filename, tracks, instruments=None, **kws):
-    with open(filename, "w") as f:
+    with open(filename, "wb") as f:
         s = SMF(tracks, instruments=instruments)
         # pass on some attributes, such as tempo, key, etc.
         s.write(f, **kws)
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Columnar note sequences.
+
+`NoteArray` holds the notes of one track as NumPy columns instead of a
+list of `Point` dicts, so `get_music` can build tracks with vectorized
+operations and `SMF.write` can encode them without touching dicts.
+'''
+
+import numpy as np
+
+from DataSounds.external.sebastian.core import (OSequence, Point, OFFSET_64,
+                                                MIDI_PITCH, DURATION_64)
+
+
+DEFAULT_VELOCITY = 64
+
+
+class NoteArray(object):
+    '''
+    Notes of a track as arrays, the counterpart of an `OSequence`.
+
+    Parameters
+    ----------
+    offset : array of int
+        Note start, in MIDI ticks.
+    pitch : array of int
+        MIDI pitch of each note.
+    duration : array of int
+        Note length, in MIDI ticks.
+    velocity : array of int, optional
+        MIDI velocity of each note, 64 by default.
+    program : array of int, optional
+        MIDI program of each note. When given, a program change is
+        written every time it changes along the track.
+    division : int
+        Ticks per quarter note. The default of 16 makes ticks 64th notes,
+        the unit of OFFSET_64 and DURATION_64.
+    '''
+
+    def __init__(self, offset, pitch, duration, velocity=None, program=None,
+                 division=16):
+        self.offset = np.asarray(offset, dtype='i8')
+        self.pitch = np.asarray(pitch, dtype='i2')
+        self.duration = np.asarray(duration, dtype='i8')
+        if velocity is None:
+            velocity = np.empty(len(self.offset), dtype='i2')
+            velocity.fill(DEFAULT_VELOCITY)
+        self.velocity = np.asarray(velocity, dtype='i2')
+        self.program = (None if program is None
+                        else np.asarray(program, dtype='i2'))
+        self.division = division
+
+    def __len__(self):
+        return len(self.offset)
+
+    def __repr__(self):
+        return "%s(%d notes)" % (self.__class__.__name__, len(self))
+
+    def columns(self):
+        '''
+        Return (offset, pitch, duration, velocity, program) columns.
+        '''
+        return (self.offset, self.pitch, self.duration, self.velocity,
+                self.program)
+
+    def next_offset(self):
+        if not len(self):
+            return 0
+        return int((self.offset + self.duration).max())
+
+    @classmethod
+    def from_sequence(cls, seq):
+        '''
+        Build a `NoteArray` from the notes of a sequence of `Point`.
+        Points without a pitch (rests, end markers) are dropped.
+        '''
+        points = [point for point in seq if point.get(MIDI_PITCH) is not None]
+        programs = [point.get('program') for point in points]
+        return cls([point[OFFSET_64] for point in points],
+                   [point[MIDI_PITCH] for point in points],
+                   [point[DURATION_64] for point in points],
+                   [point.get('velocity', DEFAULT_VELOCITY)
+                    for point in points],
+                   programs if any(p is not None for p in programs) else None)
+
+    def to_sequence(self):
+        '''
+        Convert back to an `OSequence` of `Point` dicts, with offsets and
+        durations in 64th notes.
+        '''
+        offset, duration = self.offset, self.duration
+        if self.division != 16:
+            offset = np.round(offset * 16. / self.division).astype('i8')
+            duration = np.round(duration * 16. / self.division).astype('i8')
+        points = []
+        for i in range(len(self)):
+            point = Point({OFFSET_64: int(offset[i]),
+                           MIDI_PITCH: int(self.pitch[i]),
+                           DURATION_64: int(duration[i]),
+                           'velocity': int(self.velocity[i])})
+            if self.program is not None:
+                point['program'] = int(self.program[i])
+            points.append(point)
+        return OSequence(points)
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Compact binary files for note sequences.
+
+Stores the notes of every track as fixed-width columns so renderings can be
+cached, sharded and re-encoded to MIDI without parsing again. Loading maps
+the columns with `np.memmap`, so no note data is copied until it is used.
+
+Layout (version 1, little endian)::
+
+    b'DSNOTES\0'        magic
+    uint32              format version
+    uint32              header length
+    header              JSON: tracks (note count, instrument, has
+                        programs, ticks per quarter note) and the columns
+                        (name, dtype, offset)
+    columns             one contiguous column per attribute, all tracks
+                        back to back, each starting at a 64 byte boundary
+'''
+
+import json
+import struct
+
+import numpy as np
+
+from DataSounds.external.sebastian.midi.write_midi import SMF, track_columns
+from DataSounds.notearray import NoteArray
+
+
+MAGIC = b'DSNOTES\0'
+VERSION = 1
+ALIGNMENT = 64
+
+# dtypes match NoteArray, so loaded columns are used without copies
+COLUMNS = (('offset', '<i8'), ('pitch', '<i2'), ('duration', '<i8'),
+           ('velocity', '<i2'), ('program', '<i2'))
+
+
+def _aligned(position):
+    return -(-position // ALIGNMENT) * ALIGNMENT
+
+
+def save(path, tracks, instruments=None):
+    '''
+    Save note sequences to a binary note file.
+
+    Parameters
+    ----------
+    path : str
+        output file name.
+    tracks : list
+        `NoteArray`, `OSequence` or any sequence of `Point`.
+    instruments : list of int, optional
+        MIDI program of each track, 0 by default.
+    '''
+    if instruments is None:
+        instruments = [0] * len(tracks)
+    columns = [track_columns(track) for track in tracks]
+
+    data = []
+    for i, (name, dtype) in enumerate(COLUMNS):
+        parts = []
+        for track in columns:
+            values = track[i]
+            if values is None:
+                values = np.zeros(len(track[0])) - 1
+            parts.append(np.asarray(values).astype(dtype))
+        data.append(np.concatenate(parts) if parts else np.zeros(0, dtype))
+
+    header = {
+        'tracks': [{'count': len(track[0]),
+                    'instrument': int(instrument),
+                    'programs': track[4] is not None,
+                    'division': getattr(original, 'division', 16)}
+                   for track, instrument, original
+                   in zip(columns, instruments, tracks)],
+        'columns': [],
+    }
+    # column offsets depend on the header length, which depends on the
+    # offsets: lay them out again until the header stops growing
+    encoded = b''
+    while True:
+        position = _aligned(len(MAGIC) + 8 + len(encoded))
+        header['columns'] = []
+        for (name, dtype), column in zip(COLUMNS, data):
+            header['columns'].append([name, dtype, position])
+            position = _aligned(position + column.nbytes)
+        updated = json.dumps(header).encode('utf-8')
+        if len(updated) <= len(encoded):
+            break
+        encoded = updated
+    encoded = updated
+
+    with open(path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<II', VERSION, len(encoded)))
+        f.write(encoded)
+        for (_, _, offset), column in zip(header['columns'], data):
+            f.write(b'\0' * (offset - f.tell()))
+            f.write(column.tobytes())
+
+
+def save_smf(path, smf):
+    '''
+    Save the tracks and instruments of a `SMF` to a note file.
+    '''
+    save(path, smf.tracks, smf.instruments)
+
+
+def read_header(path):
+    '''
+    Return the version and JSON header of a note file.
+    '''
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("%s is not a DataSounds note file" % path)
+        version, length = struct.unpack('<II', f.read(8))
+        if version > VERSION:
+            raise ValueError("unsupported note file version %d" % version)
+        return version, json.loads(f.read(length).decode('utf-8'))
+
+
+def load(path, mmap=True):
+    '''
+    Load a note file as a `SMF` of `NoteArray` tracks.
+
+    Parameters
+    ----------
+    mmap : bool
+        map the columns from disk instead of reading them in memory.
+
+    Returns
+    -------
+    smf : `SMF`
+        ready to `write` MIDI; `smf.tracks[i].to_sequence()` gives back
+        an `OSequence`.
+    '''
+    _, header = read_header(path)
+    total = sum(track['count'] for track in header['tracks'])
+
+    columns = {}
+    for name, dtype, offset in header['columns']:
+        if not total:
+            columns[name] = np.zeros(0, dtype)
+        elif mmap:
+            columns[name] = np.memmap(path, dtype=dtype, mode='r',
+                                      offset=offset, shape=(total,))
+        else:
+            with open(path, 'rb') as f:
+                f.seek(offset)
+                columns[name] = np.fromfile(f, dtype=dtype, count=total)
+
+    tracks = []
+    start = 0
+    for track in header['tracks']:
+        end = start + track['count']
+        view = dict((name, column[start:end])
+                    for name, column in columns.items())
+        tracks.append(NoteArray(view['offset'], view['pitch'],
+                                view['duration'], view['velocity'],
+                                view['program'] if track['programs'] else None,
+                                track.get('division', 16)))
+        start = end
+    return SMF(tracks, [track['instrument'] for track in header['tracks']])
@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Multi-core rendering of many series without copying them to workers.
+
+The input rows (and data channels) are placed in
+`multiprocessing.shared_memory` blocks. Worker processes receive only the
+block handles and a row index, build the notes of their row and return
+the encoded MIDI track, so neither the arrays nor the note sequences are
+pickled across processes.
+
+Requires Python 3.8+; `render_parallel` falls back to `get_music` when
+shared memory is not available.
+'''
+
+from io import BytesIO
+import multiprocessing
+
+import numpy as np
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+from DataSounds.sounds import get_music, prepare_series, build_melodies
+from DataSounds.external.sebastian.midi.write_midi import (
+    Thd, Trk, allocate_channels, conductor_track, note_track, scale_columns,
+    track_columns)
+
+
+CHANNELS = ('rows', 'velocity', 'duration', 'instrument', 'ticks')
+
+
+class SharedArray(object):
+    '''
+    NumPy array stored in a shared memory block.
+
+    The process creating it owns the block: use it as a context manager,
+    or call `close` and `unlink`, to release it. Other processes get the
+    same array back from `handle` with `attach`.
+
+    Example
+    -------
+    >>> with SharedArray.copy_of(data) as shared:
+    ...     pool.map(work, [shared.handle] * 4)
+    '''
+
+    def __init__(self, shape, dtype='f8', _block=None):
+        dtype = np.dtype(dtype)
+        if _block is None:
+            size = max(int(np.prod(shape)) * dtype.itemsize, 1)
+            _block = shared_memory.SharedMemory(create=True, size=size)
+            self._owner = True
+        else:
+            self._owner = False
+        self._block = _block
+        self.array = np.ndarray(shape, dtype=dtype, buffer=_block.buf)
+
+    @classmethod
+    def copy_of(cls, arr):
+        arr = np.asarray(arr)
+        shared = cls(arr.shape, arr.dtype)
+        shared.array[...] = arr
+        return shared
+
+    @property
+    def handle(self):
+        return (self._block.name, self.array.shape, self.array.dtype.str)
+
+    @classmethod
+    def attach(cls, handle):
+        name, shape, dtype = handle
+        try:
+            block = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            # before Python 3.13 attaching registers the block with the
+            # resource tracker, which would unlink it when the worker exits
+            from multiprocessing import resource_tracker
+            register = resource_tracker.register
+            resource_tracker.register = lambda name, rtype: None
+            try:
+                block = shared_memory.SharedMemory(name=name)
+            finally:
+                resource_tracker.register = register
+        return cls(shape, dtype, block)
+
+    def close(self):
+        self.array = None
+        self._block.close()
+
+    def unlink(self):
+        if self._owner:
+            self._block.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        self.unlink()
+
+
+# blocks attached by this worker process, kept open between tasks
+_attached = {}
+
+
+def _shared(handle):
+    if handle is None:
+        return None
+    name = handle[0]
+    if name not in _attached:
+        _attached[name] = SharedArray.attach(handle)
+    return _attached[name].array
+
+
+def _render_track(task):
+    '''
+    Encode the MIDI track of one row. Runs inside the worker processes.
+    '''
+    handles, broadcast, i, options, channel, instrument, shared = task
+    arrays = []
+    for name in CHANNELS:
+        arr = _shared(handles[name])
+        if arr is not None:
+            arr = arr[np.newaxis] if name in broadcast else arr[i:i + 1]
+        arrays.append(arr)
+    rows, velocity, duration, instrument_data, ticks = arrays
+
+    melody = build_melodies(rows, velocity=velocity, duration=duration,
+                            instrument=instrument_data, ticks=ticks,
+                            **options)[0]
+    columns = scale_columns(track_columns(melody), options['division'],
+                            getattr(melody, 'division', 16))
+    return note_track(columns, channel, instrument, shared).data.getvalue()
+
+
+def render_parallel(series, processes=None, key='C', mode='major', octaves=2,
+                    instruments=None, velocity=None, duration=None,
+                    instrument=None, timestamps=None, target_notes=None,
+                    target_duration=None, stat='mean', beat=None,
+                    division=16, tempo=500000, velocity_range=(32, 127),
+                    duration_range=(4, 32), programs=None, coalesce=False):
+    '''
+    Render the rows of a 2d-array on several processes.
+
+    Takes the same parameters as `get_music` (format 1 output only) and
+    gives the same MIDI file.
+
+    Parameters
+    ----------
+    processes : int, optional
+        number of worker processes, one per CPU by default.
+
+    Returns
+    -------
+    midi_out : BytesIO object.
+    '''
+    if shared_memory is None or processes == 1:
+        return get_music(
+            series, key, mode, octaves, instruments,
+            target_notes=target_notes, target_duration=target_duration,
+            stat=stat, velocity=velocity, duration=duration,
+            instrument=instrument, velocity_range=velocity_range,
+            duration_range=duration_range, programs=programs,
+            coalesce=coalesce, timestamps=timestamps, beat=beat,
+            division=division, tempo=tempo)
+
+    prepared = dict(zip(CHANNELS, prepare_series(
+        series, velocity, duration, instrument, timestamps, target_notes,
+        target_duration, stat, beat, division, tempo)))
+    rows = prepared['rows']
+    n = len(rows)
+    if instruments is None:
+        instruments = [0] * n
+
+    # same channel plan as SMF.write: rows with instrument data change
+    # program along the way and get a channel of their own
+    empty = np.isnan(rows).all(axis=1)
+    keys = [("track", i) if instrument is not None and not empty[i]
+            else instruments[i] for i in range(n)]
+    channels, shared_channels = allocate_channels(keys)
+
+    options = {'key': key, 'mode': mode, 'velocity_range': velocity_range,
+               'duration_range': duration_range, 'programs': programs,
+               'coalesce': coalesce, 'division': division}
+
+    blocks = []
+    pool = None
+    try:
+        handles = {}
+        broadcast = set()
+        for name, arr in prepared.items():
+            if arr is None:
+                handles[name] = None
+                continue
+            if n > 1 and arr.strides[0] == 0:
+                # a single row shared by every series
+                arr = arr[0]
+                broadcast.add(name)
+            blocks.append(SharedArray.copy_of(arr))
+            handles[name] = blocks[-1].handle
+
+        tasks = []
+        for i in range(n):
+            task_options = dict(options)
+            task_options['octaves'] = (octaves if isinstance(octaves, int)
+                                       else octaves[i])
+            tasks.append((handles, broadcast, i, task_options, channels[i],
+                          instruments[i], channels[i] in shared_channels))
+
+        pool = multiprocessing.Pool(processes)
+        tracks = pool.map(_render_track, tasks)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+    midi_out = BytesIO()
+    Thd(format=1, num_tracks=1 + n, division=division).write(midi_out)
+    t = conductor_track("untitled", (4, 2, 24, 8), (0, 0), tempo)
+    t.track_end()
+    t.write(midi_out)
+    for data in tracks:
+        t = Trk()
+        t.data.write(data)
+        t.write(midi_out)
+    return midi_out
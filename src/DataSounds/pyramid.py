@@ -0,0 +1,318 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Multi-resolution min/max/mean pyramid for long series.
+
+Each level aggregates `factor` elements of the level below, so level `k`
+has ``ceil(len(series) / factor ** k)`` elements. The series itself is not
+kept: the finest level, `levels[0]`, is already reduced by `factor`. The
+pyramid is built in one streaming pass over the input, can be saved to
+disk and lets `get_music` render a long series at a target number of
+notes in time proportional to the output size.
+'''
+
+import numpy as np
+
+
+STATS = ('mean', 'min', 'max', 'minmax')
+
+
+class _Level(object):
+    '''
+    Aggregated columns of one pyramid level, plus the carry of elements
+    from the level below that don't fill a whole block yet.
+    '''
+
+    def __init__(self):
+        self.parts = []
+        self.carry = None
+
+    def update(self, block, factor):
+        if self.carry is not None:
+            block = tuple(np.concatenate([c, b])
+                          for c, b in zip(self.carry, block))
+        size = len(block[0]) - len(block[0]) % factor
+        self.carry = tuple(column[size:] for column in block)
+        if not size:
+            return None
+        mins, maxs, sums, counts = (column[:size].reshape(-1, factor)
+                                    for column in block)
+        reduced = (np.fmin.reduce(mins, axis=1),
+                   np.fmax.reduce(maxs, axis=1),
+                   sums.sum(axis=1),
+                   counts.sum(axis=1))
+        self.parts.append(reduced)
+        return reduced
+
+    def flush(self):
+        if self.carry is None or not len(self.carry[0]):
+            return None
+        mins, maxs, sums, counts = self.carry
+        reduced = (np.fmin.reduce(mins, keepdims=True),
+                   np.fmax.reduce(maxs, keepdims=True),
+                   sums.sum(keepdims=True),
+                   counts.sum(keepdims=True))
+        self.carry = None
+        self.parts.append(reduced)
+        return reduced
+
+    def columns(self):
+        return tuple(np.concatenate(column) for column in zip(*self.parts))
+
+
+class Pyramid(object):
+    '''
+    Precomputed min/max/mean levels of a 1d series.
+
+    Parameters
+    ----------
+    levels : list of tuple
+        (min, max, mean, count) arrays for levels 1, 2, ..., i.e. the
+        series reduced by `factor`, `factor ** 2`, ...
+    size : int
+        Length of the original series.
+    factor : int
+        Number of elements aggregated by each level.
+
+    Example
+    -------
+    >>> pyr = Pyramid.from_series(np.random.rand(10 ** 6))
+    >>> get_music(pyr, target_notes=200)
+    <io.BytesIO at 0x7f98201c9d40>
+    '''
+
+    def __init__(self, levels, size, factor=2):
+        self.levels = levels
+        self.size = size
+        self.factor = factor
+
+    @classmethod
+    def from_chunks(cls, chunks, factor=2):
+        '''
+        Build a pyramid in one pass over an iterable of 1d chunks.
+        '''
+        if factor < 2:
+            raise ValueError("factor must be at least 2")
+        levels = []
+        size = 0
+
+        def feed(block, depth):
+            while block is not None:
+                if depth == len(levels):
+                    levels.append(_Level())
+                block = levels[depth].update(block, factor)
+                depth += 1
+
+        for chunk in chunks:
+            chunk = np.asarray(chunk, dtype='f8').ravel()
+            size += len(chunk)
+            valid = ~np.isnan(chunk)
+            feed((chunk, chunk, np.where(valid, chunk, 0.), valid * 1), 0)
+
+        if not size:
+            raise ValueError("cannot build a pyramid from an empty series")
+
+        # close partial blocks bottom-up, feeding each one to the level
+        # above, until a single element is left at the top
+        depth = 0
+        while True:
+            tail = levels[depth].flush()
+            if sum(len(part[0]) for part in levels[depth].parts) <= 1:
+                del levels[depth + 1:]
+                break
+            if tail is not None:
+                feed(tail, depth + 1)
+            depth += 1
+
+        pyramid_levels = []
+        for level in levels:
+            mins, maxs, sums, counts = level.columns()
+            with np.errstate(invalid='ignore', divide='ignore'):
+                means = np.where(counts > 0, sums / counts, np.nan)
+            pyramid_levels.append((mins, maxs, means, counts))
+        return cls(pyramid_levels, size, factor)
+
+    @classmethod
+    def from_series(cls, series, factor=2, chunksize=1 << 20):
+        series = np.asarray(series).ravel()
+        return cls.from_chunks((series[i:i + chunksize]
+                                for i in range(0, len(series), chunksize)),
+                               factor)
+
+    def __len__(self):
+        return len(self.levels)
+
+    def level_for(self, notes=None, stat='mean'):
+        '''
+        Index of the finest level rendering to at most `notes` notes.
+
+        The coarsest level is returned if none is small enough, and the
+        finest one if `notes` is None. Even the finest level has
+        ``1 / factor`` of the samples of the original series.
+        '''
+        per_bucket = 2 if stat == 'minmax' else 1
+        if notes is None:
+            return 0
+        for i, level in enumerate(self.levels):
+            if len(level[0]) * per_bucket <= notes:
+                return i
+        return len(self.levels) - 1
+
+    def series(self, notes=None, stat='mean'):
+        '''
+        Downsampled series with at most `notes` elements.
+
+        Parameters
+        ----------
+        stat : str
+            'mean', 'min', 'max' or 'minmax', which alternates the min
+            and max of each bucket to keep the envelope of the series.
+        '''
+        return self.level_series(self.level_for(notes, stat), stat)
+
+    def level_series(self, level, stat='mean'):
+        '''
+        Series of the `stat` of each bucket of a level.
+        '''
+        if stat not in STATS:
+            raise ValueError("stat must be one of %s" % (STATS,))
+        mins, maxs, means, _ = self.levels[level]
+        if stat == 'mean':
+            return means
+        elif stat == 'min':
+            return mins
+        elif stat == 'max':
+            return maxs
+        out = np.empty(2 * len(mins))
+        out[0::2] = mins
+        out[1::2] = maxs
+        return out
+
+    def save(self, path):
+        '''
+        Save the pyramid to a '.npz' file.
+        '''
+        arrays = {}
+        for i, (mins, maxs, means, counts) in enumerate(self.levels):
+            arrays['min_%d' % i] = mins
+            arrays['max_%d' % i] = maxs
+            arrays['mean_%d' % i] = means
+            arrays['count_%d' % i] = counts
+        np.savez(path, size=self.size, factor=self.factor,
+                 depth=len(self.levels), **arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            levels = [tuple(data['%s_%d' % (name, i)]
+                            for name in ('min', 'max', 'mean', 'count'))
+                      for i in range(int(data['depth']))]
+            return cls(levels, int(data['size']), int(data['factor']))
+
+
+def _pad(rows):
+    width = max(len(row) for row in rows)
+    out = np.empty((len(rows), width))
+    out.fill(np.nan)
+    for i, row in enumerate(rows):
+        out[i, :len(row)] = row
+    return out
+
+
+def _reduce_row(row, notes, stat, factor):
+    '''
+    Reduce a 1d series or a pyramid, returning the values and the
+    (depth, factor, size) of the reduction: the number of pyramid levels
+    applied, their factor and the length of the original series.
+    '''
+    if isinstance(row, Pyramid):
+        level = row.level_for(notes, stat)
+        return row.level_series(level, stat), (level + 1, row.factor, row.size)
+    row = np.asarray(row, dtype='f8').ravel()
+    if notes is None or len(row) <= notes:
+        return row, (0, factor, len(row))
+    pyramid = Pyramid.from_series(row, factor)
+    level = pyramid.level_for(notes, stat)
+    return pyramid.level_series(level, stat), (level + 1, factor, len(row))
+
+
+def reduce_series(series, notes=None, stat='mean', factor=2):
+    '''
+    Like `downsample`, but also returns how each row was reduced, so the
+    data channels of the series can be reduced alike (see `reduce_like`).
+
+    Returns
+    -------
+    values : arr
+        1d or 2d-array, as `downsample`.
+    reductions : list of tuple
+        (depth, factor, size) of each row: the number of pyramid levels
+        it was reduced by (0 if it was kept), their factor and the length
+        of the original row.
+    '''
+    if isinstance(series, (list, tuple)) and any(isinstance(s, Pyramid)
+                                                 for s in series):
+        rows = list(series)
+    elif isinstance(series, Pyramid):
+        values, reduction = _reduce_row(series, notes, stat, factor)
+        return values, [reduction]
+    else:
+        series = np.asarray(series, dtype='f8')
+        if series.ndim == 1:
+            values, reduction = _reduce_row(series, notes, stat, factor)
+            return values, [reduction]
+        rows = list(series)
+
+    reduced = [_reduce_row(row, notes, stat, factor) for row in rows]
+    return (_pad([values for values, _ in reduced]),
+            [reduction for _, reduction in reduced])
+
+
+def _reduce_to(values, reduction, stat):
+    depth, factor, size = reduction
+    values = values[:size]
+    if not depth:
+        return values
+    pyramid = Pyramid.from_series(values, factor)
+    return pyramid.level_series(min(depth, len(pyramid)) - 1, stat)
+
+
+def reduce_like(channel, reductions, stat='mean'):
+    '''
+    Reduce a data channel (velocity, timestamps, ...) with the pyramid
+    levels `reduce_series` used for the series, so both keep matching
+    lengths.
+
+    Parameters
+    ----------
+    channel : arr
+        1d-array shared by every series, or one row per series. Rows are
+        cut to the length of their series before being reduced.
+    reductions : list of tuple
+        as returned by `reduce_series`.
+    '''
+    channel = np.asarray(channel, dtype='f8')
+    if channel.ndim == 1:
+        if len(set(reductions)) == 1:
+            return _reduce_to(channel, reductions[0], stat)
+        rows = [channel] * len(reductions)
+    elif len(channel) == 1:
+        rows = [channel[0]] * len(reductions)
+    elif len(channel) == len(reductions):
+        rows = list(channel)
+    else:
+        raise ValueError("data channels need one row, or one row per "
+                         "series")
+    return _pad([_reduce_to(row, reduction, stat)
+                 for row, reduction in zip(rows, reductions)])
+
+
+def downsample(series, notes=None, stat='mean', factor=2):
+    '''
+    Reduce a series, a 2d-array or a list of pyramids to at most `notes`
+    elements per row, using pyramid levels.
+
+    Rows that already fit are returned untouched. Rows of different
+    lengths are padded with NaN, which `get_music` renders as rests.
+    '''
+    return reduce_series(series, notes, stat, factor)[0]
@@ -0,0 +1,363 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+asyncio front end for `get_music`, for use from async web backends.
+
+Rendering is CPU bound, so it runs on a process (or thread) pool and the
+event loop only waits for the result. Identical concurrent requests are
+coalesced into a single render and a bounded queue applies backpressure
+to callers when the pool is saturated.
+
+This module requires Python 3.5+.
+
+Example
+-------
+>>> service = SonificationService(max_workers=4)
+>>> midi = await service.render(data, key='D', mode='pentatonic')
+
+A minimal HTTP server is also available:
+
+    python -m DataSounds.service --port 8000
+
+    POST /render  JSON {"series": [...], "key": "C", ...} -> audio/midi
+    GET  /stats   JSON with queue depth and render latency
+'''
+
+import asyncio
+import hashlib
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from DataSounds.pyramid import Pyramid
+from DataSounds.sounds import get_music
+
+
+RENDER_OPTIONS = ('key', 'mode', 'octaves', 'instruments', 'period')
+
+
+def _render(series, kwargs):
+    '''
+    Render `series` to MIDI bytes. Runs inside the executor.
+    '''
+    return get_music(series, **kwargs).getvalue()
+
+
+def _update_digest(digest, value):
+    '''
+    Feed a request argument to `digest`. Arrays are hashed by content,
+    since their repr elides the middle of long arrays.
+    '''
+    if isinstance(value, np.ndarray):
+        digest.update(b'ndarray')
+        digest.update(repr(value.dtype.descr).encode('utf-8'))
+        digest.update(repr(value.shape).encode('ascii'))
+        digest.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, Pyramid):
+        digest.update(b'pyramid')
+        _update_digest(digest, (value.size, value.factor, value.levels))
+    elif isinstance(value, (list, tuple)):
+        digest.update(('%s%d' % (type(value).__name__, len(value)))
+                      .encode('ascii'))
+        for item in value:
+            _update_digest(digest, item)
+    elif isinstance(value, dict):
+        _update_digest(digest, sorted(value.items()))
+    else:
+        digest.update(repr(value).encode('utf-8'))
+    digest.update(b'\0')
+
+
+def request_key(series, kwargs):
+    '''
+    Hash identifying a render request, used to coalesce identical ones.
+    '''
+    digest = hashlib.sha1()
+    _update_digest(digest, series)
+    _update_digest(digest, kwargs)
+    return digest.hexdigest()
+
+
+def request_series(series):
+    '''
+    Convert `series` to a float array, keeping the structured arrays and
+    pyramids `get_music` accepts as they are.
+    '''
+    if isinstance(series, Pyramid):
+        return series
+    if isinstance(series, (list, tuple)) and any(isinstance(s, Pyramid)
+                                                 for s in series):
+        return list(series)
+    series = np.asarray(series)
+    if series.dtype.names is None:
+        series = series.astype('f8')
+    return series
+
+
+# result handed to coalesced calls when the call that queued their render
+# was cancelled first
+_REQUEUE = object()
+
+
+class SonificationService(object):
+    '''
+    Offload `get_music` renders from the event loop to a worker pool.
+
+    Parameters
+    ----------
+    executor : concurrent.futures.Executor, optional
+        Pool used for rendering. Defaults to a `ProcessPoolExecutor`
+        with `max_workers` processes, owned and shut down by the service.
+    max_workers : int, optional
+        Number of renders running at the same time.
+    max_queue : int
+        Number of requests waiting for a worker before `render` blocks.
+    '''
+
+    def __init__(self, executor=None, max_workers=None, max_queue=64):
+        self._own_executor = executor is None
+        if executor is None:
+            executor = ProcessPoolExecutor(max_workers)
+        self._executor = executor
+        self._max_workers = (max_workers or
+                             getattr(executor, '_max_workers', None) or 1)
+        self._max_queue = max_queue
+        self._loop = None
+        self._queue = None
+        self._workers = []
+        self._pending = {}
+        self._running = 0
+        self._rendered = 0
+        self._coalesced = 0
+        self._failed = 0
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+        self._latency_last = 0.0
+
+    def _start(self, loop):
+        # the queue, workers and pending futures belong to one event loop;
+        # those of a previous loop can't run anymore and are dropped
+        self._loop = loop
+        self._pending = {}
+        self._queue = asyncio.Queue(self._max_queue)
+        self._workers = [loop.create_task(self._worker())
+                         for _ in range(self._max_workers)]
+
+    async def _worker(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            key, series, kwargs, future, queued = await self._queue.get()
+            self._running += 1
+            try:
+                result = await loop.run_in_executor(
+                    self._executor, _render, series, kwargs)
+            except Exception as e:
+                self._failed += 1
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                latency = time.time() - queued
+                self._rendered += 1
+                self._latency_total += latency
+                self._latency_max = max(self._latency_max, latency)
+                self._latency_last = latency
+                if not future.done():
+                    future.set_result(result)
+            finally:
+                self._running -= 1
+                if self._pending.get(key) is future:
+                    del self._pending[key]
+                self._queue.task_done()
+
+    async def render(self, series, **kwargs):
+        '''
+        Render `series` to MIDI bytes without blocking the event loop.
+
+        Accepts the same series and keyword arguments as `get_music`.
+        Concurrent calls with identical data and arguments share a single
+        render, which goes on as long as one of them is waiting for it.
+        '''
+        loop = asyncio.get_event_loop()
+        if self._queue is None or self._loop is not loop:
+            self._start(loop)
+
+        series = request_series(series)
+        key = request_key(series, kwargs)
+        coalesced = False
+        while True:
+            future = self._pending.get(key)
+            if future is None:
+                result = await self._submit(key, series, kwargs)
+            else:
+                if not coalesced:
+                    self._coalesced += 1
+                    coalesced = True
+                result = await asyncio.shield(future)
+            if result is not _REQUEUE:
+                return result
+
+    async def _submit(self, key, series, kwargs):
+        future = self._loop.create_future()
+        self._pending[key] = future
+        try:
+            await self._queue.put((key, series, kwargs, future, time.time()))
+        except BaseException:
+            # cancelled before the request was queued: the calls coalesced
+            # onto it queue it again instead
+            del self._pending[key]
+            future.set_result(_REQUEUE)
+            raise
+        return await asyncio.shield(future)
+
+    def stats(self):
+        '''
+        Queue depth, number of renders and render latency in seconds.
+        '''
+        return {
+            'queue_depth': self._queue.qsize() if self._queue else 0,
+            'running': self._running,
+            'rendered': self._rendered,
+            'coalesced': self._coalesced,
+            'failed': self._failed,
+            'latency_last': self._latency_last,
+            'latency_max': self._latency_max,
+            'latency_mean': (self._latency_total / self._rendered
+                             if self._rendered else 0.0),
+        }
+
+    async def close(self):
+        # workers started on another (closed) loop can't be awaited here
+        if self._loop is asyncio.get_event_loop():
+            for worker in self._workers:
+                worker.cancel()
+            if self._workers:
+                await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._queue = None
+        self._loop = None
+        if self._own_executor:
+            self._executor.shutdown()
+
+
+_default_service = None
+
+
+async def render(series, **kwargs):
+    '''
+    Render `series` to MIDI bytes on a module wide `SonificationService`.
+    '''
+    global _default_service
+    if _default_service is None:
+        _default_service = SonificationService()
+    return await _default_service.render(series, **kwargs)
+
+
+_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found',
+            405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+
+def _response(writer, status, body, content_type='application/json'):
+    if not isinstance(body, bytes):
+        body = json.dumps(body).encode('utf-8')
+    writer.write(('HTTP/1.0 %d %s\r\n'
+                  'Content-Type: %s\r\n'
+                  'Content-Length: %d\r\n'
+                  'Connection: close\r\n\r\n' % (
+                      status, _REASONS[status], content_type, len(body))
+                  ).encode('ascii'))
+    writer.write(body)
+
+
+def make_handler(service):
+    '''
+    Build an `asyncio.start_server` callback serving `service` over HTTP.
+    '''
+    async def handle(reader, writer):
+        try:
+            request_line = (await reader.readline()).decode('latin-1')
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode('latin-1').strip()
+                if not line:
+                    break
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+
+            parts = request_line.split()
+            if len(parts) < 2:
+                _response(writer, 400, {'error': 'malformed request'})
+                return
+            method, path = parts[0], parts[1]
+
+            if path == '/stats':
+                _response(writer, 200, service.stats())
+            elif path != '/render':
+                _response(writer, 404, {'error': 'not found'})
+            elif method != 'POST':
+                _response(writer, 405, {'error': 'use POST'})
+            else:
+                length = int(headers.get('content-length', 0))
+                try:
+                    payload = json.loads(
+                        (await reader.readexactly(length)).decode('utf-8'))
+                    series = payload.pop('series')
+                    kwargs = dict((k, v) for k, v in payload.items()
+                                  if k in RENDER_OPTIONS)
+                except (ValueError, KeyError, AttributeError) as e:
+                    _response(writer, 400, {'error': 'bad payload: %s' % e})
+                    return
+                try:
+                    midi = await service.render(series, **kwargs)
+                except Exception as e:
+                    _response(writer, 500, {'error': str(e)})
+                else:
+                    _response(writer, 200, midi, 'audio/midi')
+        finally:
+            await writer.drain()
+            writer.close()
+
+    return handle
+
+
+async def serve(service, host='127.0.0.1', port=8000, path=None):
+    '''
+    Start the HTTP server on a TCP port, or on a Unix socket if `path`
+    is given. Returns the `asyncio.Server`.
+    '''
+    handler = make_handler(service)
+    if path is not None:
+        return await asyncio.start_unix_server(handler, path=path)
+    return await asyncio.start_server(handler, host, port)
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Serve DataSounds renders over HTTP.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--unix-socket', default=None)
+    parser.add_argument('-j', '--workers', type=int, default=None)
+    parser.add_argument('--max-queue', type=int, default=64)
+    args = parser.parse_args(argv)
+
+    loop = asyncio.get_event_loop()
+    service = SonificationService(max_workers=args.workers,
+                                  max_queue=args.max_queue)
+    server = loop.run_until_complete(
+        serve(service, args.host, args.port, args.unix_socket))
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        loop.run_until_complete(server.wait_closed())
+        loop.run_until_complete(service.close())
+
+
+if __name__ == '__main__':
+    main()
@@ -7,12 +7,16 @@ except ImportError:
     from StringIO import StringIO as BytesIO
 
 import numpy as np
+from numpy.lib.stride_tricks import as_strided
 from sys import platform
+import warnings
 import subprocess
 from DataSounds.external.sebastian.lilypond.interp import parse
 from DataSounds.external.sebastian.midi.write_midi import SMF
 from DataSounds.external.sebastian.core.transforms import stretch
 from DataSounds.external.sebastian.core import notes
+from DataSounds.pyramid import Pyramid, reduce_series, reduce_like
+from DataSounds.notearray import NoteArray
 
 
 def note_classes(arr, scale):
@@ -171,14 +175,522 @@ def chord_scaled(arr, scale, period=12):
     # return chords
 
 
+# semitones above C of each note letter
+LETTER_SEMITONES = {'c': 0, 'd': 2, 'e': 4, 'f': 5, 'g': 7, 'a': 9, 'b': 11}
+
+# MIDI pitch of the lowest octave of `build_scale` (LilyPond's "c")
+BASE_PITCH = 48
+
+
+def scale_pitches(scale):
+    '''
+    MIDI pitch of each note of a scale.
+
+    Pitches are computed from the note names, as LilyPond would read them:
+    accidentals don't change the octave, so "cb" is below "c".
+
+    Parameters
+    ----------
+    scale : an `build_scale` object
+
+    Returns
+    -------
+    pitches : arr
+        MIDI pitches, indexed by the note numbers of `note_number`.
+    '''
+    pitches = []
+    for name in scale:
+        octave = name.count("'")
+        name = name.rstrip("'")
+        accidentals = notes.modifiers(notes.value(name[0].upper() + name[1:]))
+        pitches.append(BASE_PITCH + 12 * octave +
+                       LETTER_SEMITONES[name[0]] + accidentals)
+    return np.array(pitches)
+
+
+def scale_values(arr, low, high):
+    '''
+    Linearly map the data range of an array onto integers in [low, high].
+
+    Parameters
+    ----------
+    arr : arr
+        data to be mapped, NaN are kept as NaN.
+    low, high : int
+        output range, e.g. MIDI velocities (32, 127).
+
+    Returns
+    -------
+    values : arr
+        Rounded values as floats, so missing data stays NaN.
+    '''
+    arr = np.asarray(arr, dtype='f8')
+    if np.isnan(arr).all():
+        return arr.copy()
+    minr = np.nanmin(arr)
+    maxr = np.nanmax(arr)
+    if maxr > minr:
+        scaled = (arr - minr) / (maxr - minr)
+    else:
+        scaled = arr * 0.
+    return np.round(low + scaled * (high - low))
+
+
+def program_number(arr, programs):
+    '''
+    Map data onto a list of MIDI programs, binning the data range like
+    `note_number` does with scale notes. Missing data uses the first
+    program.
+    '''
+    programs = np.asarray(programs)
+    arr = np.asarray(arr, dtype='f8')
+    if len(programs) == 1 or np.isnan(arr).all():
+        return np.zeros(len(arr), dtype=programs.dtype) + programs[0]
+    index = note_number(arr, programs)
+    index[np.isnan(index)] = 0
+    return programs[index.astype(int)]
+
+
+def run_starts(arr, *others):
+    '''
+    Indexes where runs of equal consecutive values start.
+
+    NaN are equal to each other, so a gap of missing data is one run.
+    Runs also break wherever any of the `others` arrays changes.
+
+    Example
+    -------
+    >>> run_starts([1, 1, np.nan, np.nan, 2, 2, 1])
+    array([0, 2, 4, 6])
+    '''
+    changed = np.zeros(max(len(arr) - 1, 0), dtype=bool)
+    for values in (arr,) + others:
+        values = np.asarray(values, dtype='f8')
+        both_nan = np.isnan(values[1:]) & np.isnan(values[:-1])
+        changed |= (values[1:] != values[:-1]) & ~both_nan
+    if not len(arr):
+        return np.zeros(0, dtype=int)
+    return np.concatenate([[0], np.nonzero(changed)[0] + 1])
+
+
+def timestamp_ticks(timestamps, division=16, beat=None):
+    '''
+    Quantize sample times to MIDI ticks.
+
+    Parameters
+    ----------
+    timestamps : arr
+        increasing sample times, numbers or `np.datetime64`; 2d-arrays are
+        quantized on a common time origin.
+    division : int
+        MIDI ticks per quarter note.
+    beat : float, optional
+        time span rendered as a quarter note, in the units of
+        `timestamps` (seconds for `np.datetime64`). Defaults to the
+        median sampling interval, so regular series sound as without
+        timestamps.
+
+    Returns
+    -------
+    ticks : arr of int
+        Start of each sample, in ticks from the first sample.
+    '''
+    timestamps = np.asarray(timestamps)
+    if np.issubdtype(timestamps.dtype, np.datetime64):
+        timestamps = (timestamps - timestamps.min()) / np.timedelta64(1, 's')
+    timestamps = np.asarray(timestamps, dtype='f8')
+    steps = np.diff(timestamps, axis=-1)
+    if (steps < 0).any():
+        raise ValueError("timestamps must be increasing")
+    if beat is None:
+        positive = steps[steps > 0]
+        beat = np.median(positive) if len(positive) else 1.
+    return np.round((timestamps - timestamps.min()) / beat *
+                    division).astype('i8')
+
+
+def note_array(snotes, scale, velocity=None, duration=None, program=None,
+               coalesce=False, ticks=None, division=16):
+    '''
+    Build a track from note numbers, without going through LilyPond.
+
+    Each note lasts a quarter note and starts when the previous note or
+    rest (np.nan) ends, like the melodies parsed from `note_name` output.
+
+    Parameters
+    ----------
+    snotes : arr
+        note numbers from `note_number`.
+    scale : an `build_scale` object
+    velocity : arr, optional
+        MIDI velocity of each note (see `scale_values`).
+    duration : arr, optional
+        length of each note and rest in 64th notes; NaN keeps the
+        default length.
+    program : arr, optional
+        MIDI program of each note (see `program_number`).
+    coalesce : bool
+        Merge runs of the same note into a single sustained note, and
+        runs of rests into a single rest. Merged notes keep the velocity
+        of their first note.
+    ticks : arr of int, optional
+        start of each note in ticks (see `timestamp_ticks`). Notes then
+        last until the next sample, and the last one a quarter note.
+    division : int
+        MIDI ticks per quarter note.
+
+    Returns
+    -------
+    track : `DataSounds.notearray.NoteArray`
+    '''
+    snotes = np.asarray(snotes, dtype='f8')
+    n = len(snotes)
+    if ticks is None:
+        steps = np.zeros(n, dtype='i8') + division
+    else:
+        offsets = np.asarray(ticks, dtype='i8')
+        steps = np.diff(np.append(offsets, offsets[-1:] + division))
+
+    lengths = steps.copy()
+    if duration is not None:
+        duration = np.asarray(duration, dtype='f8')
+        valid = ~np.isnan(duration)
+        lengths[valid] = np.round(duration[valid] * division / 16.)
+        if ticks is None:
+            steps = lengths
+    if ticks is None:
+        offsets = np.cumsum(steps) - steps
+
+    if coalesce and n:
+        starts = run_starts(snotes, *([] if program is None else [program]))
+        ends = np.append(starts[1:], n) - 1
+        lengths = offsets[ends] - offsets[starts] + lengths[ends]
+        offsets = offsets[starts]
+        snotes = snotes[starts]
+        if velocity is not None:
+            velocity = np.asarray(velocity, dtype='f8')[starts]
+        if program is not None:
+            program = np.asarray(program)[starts]
+
+    played = ~np.isnan(snotes)
+    pitches = scale_pitches(scale)[snotes[played].astype(int)]
+    if velocity is not None:
+        velocity = np.asarray(velocity, dtype='f8')[played]
+        velocity[np.isnan(velocity)] = 64
+    if program is not None:
+        program = np.asarray(program)[played]
+    return NoteArray(offsets[played], pitches, lengths[played],
+                     velocity, program, division)
+
+
+def prepare_series(series, velocity=None, duration=None, instrument=None,
+                   timestamps=None, target_notes=None, target_duration=None,
+                   stat='mean', beat=None, division=16, tempo=500000):
+    '''
+    Bring the inputs of `get_music` to 2d rows, one per track.
+
+    Splits structured arrays into data channels, reduces long series to
+    the target size and quantizes timestamps.
+
+    Returns
+    -------
+    rows, velocity, duration, instrument, ticks : arr
+        2d-arrays of the same shape (or None for missing channels).
+    '''
+    fields = getattr(getattr(series, 'dtype', None), 'names', None)
+    if fields:
+        if velocity is None and 'velocity' in fields:
+            velocity = series['velocity']
+        if duration is None and 'duration' in fields:
+            duration = series['duration']
+        if instrument is None and 'instrument' in fields:
+            instrument = series['instrument']
+        series = series['pitch' if 'pitch' in fields else fields[0]]
+
+    if target_notes is None and target_duration is not None:
+        target_notes = max(int(target_duration / (tempo / 1e6)), 1)
+    if timestamps is not None:
+        timestamps = np.asarray(timestamps)
+        if np.issubdtype(timestamps.dtype, np.datetime64):
+            timestamps = (timestamps - timestamps.min()) / np.timedelta64(1, 's')
+    if target_notes is not None or isinstance(series, Pyramid) or (
+            isinstance(series, (list, tuple)) and
+            any(isinstance(s, Pyramid) for s in series)):
+        # data channels and timestamps are reduced by the same pyramid
+        # levels as their series
+        series, reductions = reduce_series(series, target_notes, stat)
+        velocity, duration, instrument = [
+            None if channel is None else
+            reduce_like(channel, reductions, stat)
+            for channel in (velocity, duration, instrument)]
+        if timestamps is not None:
+            # buckets start at their first sample; min and max values are
+            # placed at the first and last sample of their bucket
+            timestamps = reduce_like(timestamps, reductions,
+                                     'minmax' if stat == 'minmax' else 'min')
+
+    series = np.array(series)
+    rows = series.reshape(1, -1) if series.ndim == 1 else series
+    velocity, duration, instrument = [
+        None if channel is None else
+        np.broadcast_to(np.atleast_2d(np.asarray(channel, dtype='f8')),
+                        rows.shape)
+        for channel in (velocity, duration, instrument)]
+    ticks = None
+    if timestamps is not None:
+        ticks = np.broadcast_to(
+            np.atleast_2d(timestamp_ticks(timestamps, division, beat)),
+            rows.shape)
+
+    return rows, velocity, duration, instrument, ticks
+
+
+def check_velocity_range(velocity_range):
+    '''
+    Raise a ValueError unless `velocity_range` is a (low, high) pair of
+    MIDI velocities, between 0 and 127.
+    '''
+    low, high = velocity_range
+    if not 0 <= low <= high <= 127:
+        raise ValueError("velocity_range must be within 0 and 127, got %r"
+                         % (tuple(velocity_range),))
+
+
+def build_melodies(rows, key='C', mode='major', octaves=2, velocity=None,
+                   duration=None, instrument=None, ticks=None,
+                   velocity_range=(32, 127), duration_range=(4, 32),
+                   programs=None, coalesce=False, division=16):
+    '''
+    Build one track per row of `prepare_series` output, see `get_music`
+    for the parameters.
+
+    Returns
+    -------
+    melodies : list of `NoteArray`
+        Empty lists stand for rows without data.
+    '''
+    if instrument is not None and programs is None:
+        raise ValueError("`programs` is required to map `instrument` data")
+    check_velocity_range(velocity_range)
+
+    melodies = []
+    for i, row in enumerate(rows):
+        if all(np.isnan(row)):
+            melodies.append([])
+            continue
+
+        if isinstance(octaves, int):
+            scale = build_scale(key, mode, octaves)
+        else:
+            scale = build_scale(key, mode, octaves[i])
+
+        snotes = note_number(row, scale)
+        melody = note_array(
+            snotes, scale,
+            None if velocity is None else scale_values(velocity[i],
+                                                       *velocity_range),
+            None if duration is None else scale_values(duration[i],
+                                                       *duration_range),
+            None if instrument is None else program_number(instrument[i],
+                                                           programs),
+            coalesce, None if ticks is None else ticks[i], division)
+        melodies.append(melody)
+    return melodies
+
+
+def _spectrum(frames, taper):
+    '''
+    Amplitude spectrum of each row of `frames`, after removing its mean.
+    Missing data count as the mean, and empty frames give zeros.
+    '''
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        mean = np.nanmean(frames, axis=1)
+    centered = frames - mean[:, np.newaxis]
+    centered[np.isnan(centered)] = 0.
+    # scaled so a sinusoid of amplitude A peaks at A
+    return np.abs(np.fft.rfft(centered * taper, axis=1)) * 2. / taper.sum()
+
+
+def stft(chunks, window=256, hop=None):
+    '''
+    Short-time Fourier transform over a stream of chunks.
+
+    Windows overlapping two chunks are completed with the samples carried
+    over from the previous chunk, so the output doesn't depend on how the
+    series is split. Windows of each chunk are strided views of it and
+    go through a single `np.fft.rfft` call.
+
+    Parameters
+    ----------
+    chunks : iterable of arr
+        consecutive pieces of a 1d series; NaN are missing data.
+    window : int
+        samples per window, tapered with a Hann window.
+    hop : int, optional
+        samples between window starts, half a window by default.
+
+    Returns
+    -------
+    spectra : generator of arr
+        (windows, window // 2 + 1) amplitudes for each chunk that
+        completes at least one window. A last window padded with NaN
+        covers the samples left at the end of the series.
+    '''
+    hop = hop or window // 2
+    if not 0 < hop <= window:
+        raise ValueError("hop must be between 1 and window")
+    taper = np.hanning(window)
+    carry = np.zeros(0)
+    emitted = False
+    for chunk in chunks:
+        data = np.concatenate([carry, np.asarray(chunk, dtype='f8').ravel()])
+        count = (len(data) - window) // hop + 1 if len(data) >= window else 0
+        if count:
+            frames = as_strided(data, shape=(count, window),
+                                strides=(data.strides[0] * hop,
+                                         data.strides[0]))
+            yield _spectrum(frames, taper)
+            emitted = True
+        carry = data[count * hop:]
+
+    if len(carry) > window - hop or (len(carry) and not emitted):
+        frame = np.empty(window)
+        frame.fill(np.nan)
+        frame[:len(carry)] = carry
+        yield _spectrum(frame[np.newaxis], taper)
+
+
+def spectral_notes(series, key='C', mode='major', octaves=2, window=256,
+                   hop=None, voices=3, velocity_range=(32, 127),
+                   division=16):
+    '''
+    Chords following the spectrum of a series, one chord per window.
+
+    The frequency bins of each window (see `stft`) are grouped into as
+    many equal bands as there are notes in the scale, lowest band to the
+    lowest note. The `voices` strongest bands of each window are played
+    together for a quarter note, louder as their amplitude grows.
+
+    Parameters
+    ----------
+    series : arr or iterable of arr
+        1d series, or consecutive chunks of one.
+    key, mode, octaves :
+        scale of the chords, see `build_scale`.
+    window, hop : int
+        STFT window length and step, in samples.
+    voices : int
+        notes per chord.
+    velocity_range : tuple
+        MIDI velocities of the weakest and strongest bands, mapped on a
+        log scale over the whole series.
+    division : int
+        MIDI ticks per quarter note.
+
+    Returns
+    -------
+    track : `DataSounds.notearray.NoteArray`
+    '''
+    check_velocity_range(velocity_range)
+    scale = build_scale(key, mode, octaves)
+    bins = window // 2
+    if bins < len(scale):
+        raise ValueError("window must have at least %d samples for a "
+                         "%d notes scale" % (2 * len(scale), len(scale)))
+    edges = np.linspace(1, bins + 1, len(scale) + 1).astype(int)[:-1]
+    voices = min(voices, len(scale))
+
+    if isinstance(series, np.ndarray):
+        series = [series]
+    bands = []
+    amplitudes = []
+    for spectrum in stft(series, window, hop):
+        amplitude = np.sqrt(np.add.reduceat(spectrum ** 2, edges, axis=1))
+        strongest = np.argpartition(-amplitude, voices - 1,
+                                    axis=1)[:, :voices]
+        rows = np.arange(len(amplitude))[:, np.newaxis]
+        bands.append(strongest)
+        amplitudes.append(amplitude[rows, strongest])
+
+    if not bands:
+        return NoteArray([], [], [], division=division)
+    bands = np.concatenate(bands)
+    amplitudes = np.concatenate(amplitudes)
+
+    offsets = np.repeat(np.arange(len(bands)) * division, voices)
+    bands = bands.ravel()
+    amplitudes = amplitudes.ravel()
+    played = amplitudes > 0
+    velocity = scale_values(np.log(amplitudes[played]), *velocity_range)
+    lengths = np.zeros(played.sum(), dtype='i8') + division
+    return NoteArray(offsets[played], scale_pitches(scale)[bands[played]],
+                     lengths, velocity, division=division)
+
+
+def get_spectral_music(series, key='C', mode='major', octaves=2,
+                       instruments=None, window=256, hop=None, voices=3,
+                       velocity_range=(32, 127), division=16, tempo=500000):
+    '''
+    Returns music following the spectrum of long series.
+
+    Instead of a note per sample, as `get_music`, each STFT window of the
+    series is played as a chord of its dominant frequency bands (see
+    `spectral_notes`), so the output grows with the number of windows.
+
+    Parameters
+    ----------
+    series : arr or iterable of arr
+        a series, a 2d-array with a series per row, or an iterable of
+        consecutive chunks of a single series (e.g. read from disk), which
+        is never loaded whole.
+
+    instruments : list of MIDI instruments, one per series.
+
+    Other parameters as `spectral_notes` and `get_music`.
+
+    Returns
+    -------
+    midi_out : BytesIO object.
+
+    Example
+    -------
+    >>> t = np.arange(10 ** 6)
+    >>> get_spectral_music(np.sin(t / 20.) + np.sin(t / 3.), window=512)
+    <io.BytesIO at 0x7f98201c9d40>
+    '''
+    if isinstance(series, np.ndarray) and series.ndim > 1:
+        rows = list(series)
+    else:
+        rows = [series]
+    tracks = [spectral_notes(row, key, mode, octaves, window, hop, voices,
+                             velocity_range, division) for row in rows]
+
+    midi_out = BytesIO()
+    if instruments is None:
+        s = SMF(tracks)
+    else:
+        s = SMF(tracks, instruments)
+    s.write(midi_out, division=division, tempo=tempo)
+    return midi_out
+
+
 def get_music(series, key='C', mode='major', octaves=2,
-              instruments=None, period=12):
+              instruments=None, period=12, target_notes=None,
+              target_duration=None, stat='mean', velocity=None,
+              duration=None, instrument=None, velocity_range=(32, 127),
+              duration_range=(4, 32), programs=None, midi_format=1,
+              coalesce=False, timestamps=None, beat=None, division=16,
+              tempo=500000, index=None, index_every=64):
     '''
     Returns music generated from an inserted series.
 
     Parameters
     ----------
     series : an array that could be an 2d-array.
+        A structured array can also be used, taking pitch data from the
+        'pitch' field (or the first one) and extra data channels from
+        'velocity', 'duration' and 'instrument' fields.
 
     key : Musical key.
         Can be setted as a parameter while building scale.
@@ -403,6 +915,71 @@ def get_music(series, key='C', mode='major', octaves=2,
     period : int
         parameter of chord_scaled function.
 
+    target_notes : int, optional
+        Maximum number of notes per series. Longer series are reduced
+        using a `DataSounds.pyramid.Pyramid` level.
+
+    target_duration : float, optional
+        Maximum duration in seconds, an alternative to `target_notes`.
+
+    stat : str
+        Statistic used when reducing series: 'mean', 'min', 'max' or
+        'minmax'. `series` can also be a `Pyramid` (or a list of them),
+        so renders at different zoom levels only cost the output size.
+        A pyramid doesn't keep the original samples: without
+        `target_notes` it is rendered from its finest level, at
+        ``1 / factor`` of the original resolution.
+
+    velocity : array, optional
+        Extra data channel, same shape as `series` (or one row shared by
+        all series), linearly mapped to MIDI velocities in
+        `velocity_range`, which must be within 0 and 127.
+
+    duration : array, optional
+        Extra data channel linearly mapped to note lengths in 64th notes
+        in `duration_range` (16 is a quarter note). Following notes start
+        when the previous one ends.
+
+    instrument : array, optional
+        Extra data channel binned onto the MIDI `programs` list, with a
+        program change written whenever the program changes.
+
+    midi_format : int
+        1 writes one MIDI track per series, 0 merges them into a single
+        track. Series are packed into the 15 melodic MIDI channels,
+        sharing channels between series with the same instrument when
+        there are more series than channels.
+
+    coalesce : bool
+        Merge repeated consecutive notes into sustained notes and runs of
+        missing data into a single rest, which cuts the number of MIDI
+        events of slowly varying or gappy series.
+
+    timestamps : array, optional
+        Sample times (numbers or `np.datetime64`) of irregularly sampled
+        series, one row shared by all series or one per series. Notes
+        start at their quantized time and last until the next sample, so
+        gaps are kept without resampling. See `timestamp_ticks`.
+
+    beat : float, optional
+        Time span rendered as a quarter note, in the units of
+        `timestamps` (seconds for `np.datetime64`). Defaults to the median
+        sampling interval.
+
+    division : int
+        MIDI ticks per quarter note, i.e. the time resolution.
+
+    tempo : int
+        Microseconds per quarter note.
+
+    index : str or file, optional
+        Where to save a tick index of the MIDI file, so excerpts of it
+        can later be read without parsing it all (see
+        `DataSounds.excerpt`).
+
+    index_every : int
+        Note messages between index entries.
+
     Returns
     -------
     midi_out : BytesIO object.
@@ -422,42 +999,23 @@ def get_music(series, key='C', mode='major', octaves=2,
     '''
     midi_out = BytesIO()
 
-    series = np.array(series)
-    scales = []
-    melodies = []
-    if len(series.shape) == 1:
-        scale = build_scale(key, mode, octaves)
-        if all(np.isnan(series)):
-            melody = []
-            melodies.append(melody)
-        else:
-            snotes = note_number(series, scale)
-            melody = parse(' '.join([note_name(x, scale) for x in snotes]))
-            melodies.append(melody)
-    else:
-        for i in range(series.shape[0]):
-            if all(np.isnan(series[i])):
-                melody = []
-                melodies.append(melody)
-            else:
-                if isinstance(octaves, int):
-                    scales.append(build_scale(key, mode, octaves))
-                else:
-                    scales.append(build_scale(key, mode, octaves[i]))
-
-                snotes = note_number(series[i], scales[i])
-                melody = parse(' '.join([note_name(x, scales[i]) for x in snotes]))
-                melodies.append(melody)
-
-            # chords = chord_scaled(series, scale, period)
-            # Transform it to a MIDI file with chords.
-            # s = SMF([melody, chords], instruments=[0, 23])
+    rows, velocity, duration, instrument, ticks = prepare_series(
+        series, velocity, duration, instrument, timestamps, target_notes,
+        target_duration, stat, beat, division, tempo)
+    melodies = build_melodies(
+        rows, key, mode, octaves, velocity, duration, instrument, ticks,
+        velocity_range, duration_range, programs, coalesce, division)
+
+    # chords = chord_scaled(series, scale, period)
+    # Transform it to a MIDI file with chords.
+    # s = SMF([melody, chords], instruments=[0, 23])
     if instruments is None:
         s = SMF(melodies)
     else:
         s = SMF(melodies, instruments)
 
-    s.write(midi_out)
+    s.write(midi_out, format=midi_format, division=division, tempo=tempo,
+            index=index, index_every=index_every)
     return midi_out
 
 def w2Midi(name, BytesIo):
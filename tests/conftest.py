@@ -0,0 +1,7 @@
+import sys
+
+
+# modules using async/await syntax can't even be compiled before 3.5
+collect_ignore = []
+if sys.version_info < (3, 5):
+    collect_ignore.append('test_service.py')
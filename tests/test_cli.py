@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+
+import os
+import stat
+
+import numpy as np
+
+from DataSounds.cli import (main, find_inputs, EXIT_OK, EXIT_FAILURE,
+                            EXIT_USAGE, EXIT_NOINPUT)
+
+
+def test_find_inputs(tmpdir):
+    np.save(str(tmpdir.join('a.npy')), np.random.rand(10))
+    tmpdir.join('b.csv').write('1,2\n3,4\n')
+    tmpdir.join('c.txt').write('ignored')
+    found = find_inputs([str(tmpdir)])
+    assert [os.path.basename(f) for f in found] == ['a.npy', 'b.csv']
+
+
+def test_main_renders_and_skips(tmpdir, capsys):
+    np.save(str(tmpdir.join('a.npy')), np.random.rand(10))
+    tmpdir.join('b.csv').write('1,2\n3,4\n5,6\n')
+    out = tmpdir.mkdir('out')
+
+    argv = [str(tmpdir.join('*')), '-o', str(out), '-j', '1']
+    assert main(argv) == EXIT_OK
+    for name in ('a.midi', 'b.midi'):
+        assert out.join(name).read_binary()[:4] == b'MThd'
+
+    assert main(argv) == EXIT_OK
+    assert '0 rendered, 2 skipped' in capsys.readouterr()[0]
+
+    # other render options make the outputs stale
+    assert main(argv + ['--key', 'D']) == EXIT_OK
+    assert '2 rendered, 0 skipped' in capsys.readouterr()[0]
+    assert main(argv + ['--key', 'D']) == EXIT_OK
+    assert '0 rendered, 2 skipped' in capsys.readouterr()[0]
+
+
+def test_main_hash_check(tmpdir, capsys):
+    np.save(str(tmpdir.join('a.npy')), np.random.rand(10))
+    argv = [str(tmpdir), '-j', '1', '--check', 'hash']
+    assert main(argv) == EXIT_OK
+    assert tmpdir.join('a.midi.sha1').check()
+    assert main(argv) == EXIT_OK
+    assert '0 rendered, 1 skipped' in capsys.readouterr()[0]
+
+
+def test_main_exit_codes(tmpdir):
+    assert main([str(tmpdir)]) == EXIT_NOINPUT
+    tmpdir.join('bad.npy').write('not an array')
+    assert main([str(tmpdir), '-j', '1']) == EXIT_FAILURE
+
+    # text parses as NaN, which would render a silent file
+    tmpdir.join('bad.npy').remove()
+    tmpdir.join('text.csv').write('x,y\nfoo,bar\n')
+    assert main([str(tmpdir), '-j', '1']) == EXIT_FAILURE
+    assert not tmpdir.join('text.midi').check()
+
+
+def test_main_output_clash(tmpdir, capsys):
+    np.save(str(tmpdir.join('a.npy')), np.random.rand(10))
+    tmpdir.join('a.csv').write('1,2\n3,4\n')
+    assert main([str(tmpdir), '-j', '1']) == EXIT_USAGE
+    assert 'a.midi' in capsys.readouterr()[1]
+    assert not tmpdir.join('a.midi').check()
+
+    np.save(str(tmpdir.mkdir('x').join('b.npy')), np.random.rand(10))
+    np.save(str(tmpdir.mkdir('y').join('b.npy')), np.random.rand(10))
+    argv = [str(tmpdir.join('x')), str(tmpdir.join('y')),
+            '-o', str(tmpdir.join('out'))]
+    assert main(argv) == EXIT_USAGE
+    assert not tmpdir.join('out').check()
+
+
+def test_main_file_mode(tmpdir):
+    np.save(str(tmpdir.join('a.npy')), np.random.rand(10))
+    umask = os.umask(0o022)
+    try:
+        assert main([str(tmpdir), '-j', '1', '--check', 'hash']) == EXIT_OK
+    finally:
+        os.umask(umask)
+    for name in ('a.midi', 'a.midi.sha1'):
+        mode = stat.S_IMODE(os.stat(str(tmpdir.join(name))).st_mode)
+        assert mode == 0o644
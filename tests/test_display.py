@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+import os
+import stat
+
+import pytest
+
+from DataSounds.external.sebastian.core import OSequence, display_all
+from DataSounds.external.sebastian.lilypond import render
+from DataSounds.external.sebastian.lilypond.interp import parse
+
+
+# stands in for lilypond: writes the source it reads to the preview file
+# and counts its runs
+STUB = '''#!/bin/sh
+for arg in "$@"; do
+    case "$arg" in
+        -o*) base="${arg#-o}" ;;
+        -dbackend=svg) suffix=svg ;;
+    esac
+done
+echo run >> "%s"
+if [ "$suffix" = svg ]; then
+    { echo '<svg xmlns="http://www.w3.org/2000/svg"><desc>'; cat
+      echo '</desc></svg>'; } > "$base.preview.svg"
+else
+    cat > "$base.preview.png"
+fi
+'''
+
+
+@pytest.fixture
+def lilypond(tmpdir, monkeypatch):
+    runs = tmpdir.join('runs')
+    script = tmpdir.join('lilypond')
+    script.write(STUB % runs)
+    os.chmod(str(script), stat.S_IRWXU)
+    monkeypatch.setattr(render, 'LILYPOND', str(script))
+    monkeypatch.setattr(render, 'CACHE_DIR', str(tmpdir.join('cache')))
+
+    def count():
+        return len(runs.readlines()) if runs.check() else 0
+    return count
+
+
+def data(shown):
+    # IPython display objects keep SVG data as text
+    shown = getattr(shown, 'data', shown)
+    return shown if isinstance(shown, bytes) else shown.encode('utf-8')
+
+
+def test_display_cached(lilypond):
+    seq = parse("c4 d8 e")
+    first = data(seq.display())
+    assert b"c'4" in first
+    assert data(seq.display()) == first
+    assert lilypond() == 1
+
+    # a different format or sequence runs lilypond again
+    assert b"c'4" in data(seq.display("svg"))
+    parse("f2").display()
+    assert lilypond() == 3
+
+
+def test_display_all(lilypond):
+    seqs = [parse("c4"), parse("c8"), parse("c4"), parse("c2")]
+    shown = [data(s) for s in display_all(seqs)]
+    # the repeated sequence is rendered once
+    assert lilypond() == 3
+    assert shown == [data(s.display()) for s in seqs]
+    assert shown[0] == shown[2] and shown[0] != shown[1]
+    assert lilypond() == 3
+
+
+def test_display_empty(lilypond):
+    seq = OSequence([])
+    # a textual display, without running lilypond
+    assert seq.display() is seq
+    assert seq._repr_png_() is None and seq._repr_svg_() is None
+    assert lilypond() == 0
+
+
+def test_failure_not_cached(tmpdir, monkeypatch):
+    monkeypatch.setattr(render, 'LILYPOND', 'false')
+    cache = render.RenderCache(str(tmpdir.join('cache')))
+    assert render.render("{ c'4 }", cache=cache) is None
+    assert not tmpdir.join('cache').check()
+
+
+def test_eviction(tmpdir):
+    cache = render.RenderCache(str(tmpdir), max_bytes=30)
+    for i, key in enumerate(['a', 'b', 'c']):
+        cache.put(key, 'png', b'x' * 10)
+        os.utime(cache.path(key, 'png'), (i, i))
+    # reading 'a' makes 'b' the least recently used
+    cache.get('a', 'png')
+    cache.put('d', 'png', b'x' * 10)
+    assert sorted(os.listdir(str(tmpdir))) == ['a.png', 'c.png', 'd.png']
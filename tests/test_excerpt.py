@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+import numpy as np
+import pytest
+
+from DataSounds.excerpt import excerpt, index_path, load_index
+from DataSounds.external.sebastian.midi.write_midi import SMF
+from DataSounds.notearray import NoteArray
+from DataSounds.sounds import get_music
+
+from .test_write_midi import read_tracks
+
+
+def random_tracks(n, size, seed=0):
+    rng = np.random.RandomState(seed)
+    tracks = []
+    for _ in range(n):
+        # notes of a track don't overlap, since MIDI can't tell apart
+        # overlapping notes of the same pitch
+        steps = rng.randint(1, 20, size)
+        tracks.append(NoteArray(np.cumsum(steps) - steps,
+                                rng.randint(40, 80, size),
+                                (rng.rand(size) * (steps + 1)).astype(int),
+                                rng.randint(1, 128, size)))
+    return tracks
+
+
+def played(events):
+    '''
+    Sorted (start, channel, pitch, velocity) and (end, channel, pitch) of
+    the notes of a track.
+    '''
+    starts = []
+    ends = []
+    for tick, status, data in events:
+        data = bytearray(data)
+        if status & 0xF0 == 0x90:
+            starts.append((tick, status & 0x0F, data[0], data[1]))
+        elif status & 0xF0 == 0x80:
+            ends.append((tick, status & 0x0F, data[0]))
+    return sorted(starts), sorted(ends)
+
+
+def expected(tracks, start, end):
+    notes = [(int(o), c, int(p), int(v), int(min(o + d, end)))
+             for c, track in enumerate(tracks)
+             for o, p, d, v in zip(*track.columns()[:4])
+             if start <= o < end]
+    return (sorted((o - start, c, p, v) for o, c, p, v, _ in notes),
+            sorted((e - start, c, p) for _, c, p, _, e in notes))
+
+
+@pytest.mark.parametrize('midi_format', [0, 1])
+def test_excerpt(tmpdir, midi_format):
+    path = str(tmpdir.join('long.midi'))
+    tracks = random_tracks(3, 400)
+    with open(path, 'wb') as f:
+        SMF(tracks, [0, 5, 40]).write(f, format=midi_format,
+                                      index=index_path(path), index_every=7)
+
+    index = load_index(index_path(path))
+    assert len(index['bounds']) == (1 if midi_format == 0 else 4)
+    for start, end in [(0, 50), (1000, 1300), (3000, 10 ** 6)]:
+        decoded = read_tracks(excerpt(path, start, end, index).getvalue())
+        if midi_format == 0:
+            assert played(decoded[0]) == expected(tracks, start, end)
+        else:
+            for events, track, channel in zip(decoded[1:], tracks, range(3)):
+                starts, ends = expected([track], start, end)
+                assert played(events) == (
+                    [(t, channel, p, v) for t, _, p, v in starts],
+                    [(t, channel, p) for t, _, p in ends])
+        # tempo and instruments are set up before the notes
+        assert (0, 0xFF, b'\x51\x03\x07\xa1\x20') in decoded[0]
+        programs = [(status & 0x0F, data) for events in decoded
+                    for _, status, data in events if status & 0xF0 == 0xC0]
+        assert set(programs) >= set([(0, b'\x00'), (1, b'\x05'), (2, b'\x28')])
+
+
+def test_excerpt_programs(tmpdir):
+    path = str(tmpdir.join('programs.midi'))
+    data = np.sin(np.arange(200) / 10.)
+    with open(path, 'wb') as f:
+        f.write(get_music(data, instrument=np.arange(200), programs=[3, 9],
+                          index=index_path(path), index_every=4).getvalue())
+
+    # the program in use when the excerpt starts is set at its beginning
+    track = read_tracks(excerpt(path, 180 * 16, 190 * 16).getvalue())[1]
+    changes = [(tick, data) for tick, status, data in track
+               if status & 0xF0 == 0xC0]
+    assert changes[-1] == (0, b'\x09')
+    assert len(played(track)[0]) == 10
+
+    with pytest.raises(ValueError):
+        excerpt(path, 10, 10)
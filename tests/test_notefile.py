@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+
+from io import BytesIO
+
+import numpy as np
+import pytest
+
+from DataSounds import notefile
+from DataSounds.external.sebastian.lilypond.interp import parse
+from DataSounds.external.sebastian.midi.write_midi import SMF
+from DataSounds.notearray import NoteArray
+
+
+def midi(smf):
+    out = BytesIO()
+    smf.write(out)
+    return out.getvalue()
+
+
+def test_roundtrip(tmpdir):
+    path = str(tmpdir.join('notes.dsn'))
+    tracks = [NoteArray([0, 16], [60, 62], [16, 8], [10, 20], [3, 4]),
+              parse("c4 d8 e16"),
+              []]
+    smf = SMF(tracks, [5, 40, 0])
+    notefile.save_smf(path, smf)
+
+    loaded = notefile.load(path)
+    assert loaded.instruments == [5, 40, 0]
+    assert isinstance(loaded.tracks[0].offset.base, np.memmap)
+    assert all(loaded.tracks[0].program == [3, 4])
+    assert loaded.tracks[1].program is None
+    assert len(loaded.tracks[2]) == 0
+    assert loaded.tracks[1].to_sequence()[2]['midi_pitch'] == 52
+    assert midi(loaded) == midi(smf)
+    assert midi(notefile.load(path, mmap=False)) == midi(smf)
+
+
+def test_bad_file(tmpdir):
+    path = tmpdir.join('bad.dsn')
+    path.write('not notes')
+    with pytest.raises(ValueError):
+        notefile.load(str(path))
@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+
+import numpy as np
+import pytest
+
+from DataSounds import parallel
+from DataSounds.sounds import get_music
+
+requires_shared_memory = pytest.mark.skipif(
+    parallel.shared_memory is None, reason="requires Python 3.8+")
+
+
+@requires_shared_memory
+def test_render_parallel_matches_get_music():
+    data = np.random.rand(6, 50)
+    data[2] = np.nan
+    kwargs = dict(key='D', octaves=[1, 2, 3, 1, 2, 3],
+                  instruments=[0, 23, 40, 0, 23, 40])
+    expected = get_music(data, **kwargs).getvalue()
+    assert parallel.render_parallel(data, 2, **kwargs).getvalue() == expected
+
+
+@requires_shared_memory
+def test_render_parallel_data_channels():
+    data = np.random.rand(20, 30)
+    kwargs = dict(velocity=data[::-1], instrument=data, programs=[0, 40],
+                  timestamps=np.cumsum(np.random.rand(30)), coalesce=True)
+    expected = get_music(data, **kwargs).getvalue()
+    assert parallel.render_parallel(data, 3, **kwargs).getvalue() == expected
+
+
+@requires_shared_memory
+def test_shared_array_lifecycle():
+    data = np.arange(10.)
+    with parallel.SharedArray.copy_of(data) as shared:
+        attached = parallel.SharedArray.attach(shared.handle)
+        assert all(attached.array == data)
+        shared.array[0] = 42
+        assert attached.array[0] == 42
+        attached.close()
+        handle = shared.handle
+    with pytest.raises(FileNotFoundError):
+        parallel.SharedArray.attach(handle)
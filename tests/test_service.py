@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+
+# Python 3.5+ only: not collected by conftest.py on older versions
+
+import asyncio
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from DataSounds.pyramid import Pyramid
+from DataSounds.service import (SonificationService, request_key,
+                                request_series, serve)
+
+
+def run(coro):
+    # like asyncio.run (3.7+): tasks left running are cancelled
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        all_tasks = getattr(asyncio, 'all_tasks', None) or asyncio.Task.all_tasks
+        pending = [task for task in all_tasks(loop) if not task.done()]
+        for task in pending:
+            task.cancel()
+        if pending:
+            loop.run_until_complete(asyncio.gather(*pending,
+                                                   return_exceptions=True))
+        loop.close()
+
+
+def test_render_coalesces_identical_requests():
+    data = np.random.rand(30)
+    service = SonificationService(ThreadPoolExecutor(2), max_workers=2)
+
+    async def go():
+        results = await asyncio.gather(
+            service.render(data, key='D'),
+            service.render(data, key='D'),
+            service.render(data, key='E'))
+        stats = service.stats()
+        await service.close()
+        return results, stats
+
+    results, stats = run(go())
+    assert results[0] == results[1]
+    assert results[0][:4] == b'MThd'
+    assert stats['rendered'] == 2
+    assert stats['coalesced'] == 1
+    assert stats['queue_depth'] == 0
+
+
+def test_cancelled_request_hands_over_coalesced():
+    # the only thread is blocked, so the first request keeps the worker
+    # busy, the second fills the queue and the third waits to be queued
+    executor = ThreadPoolExecutor(1)
+    gate = threading.Event()
+    executor.submit(gate.wait)
+    service = SonificationService(executor, max_workers=1, max_queue=1)
+    data = [np.random.rand(10) for _ in range(3)]
+
+    async def go():
+        loop = asyncio.get_event_loop()
+        tasks = [loop.create_task(service.render(d)) for d in data]
+        await asyncio.sleep(0.05)
+        coalesced = loop.create_task(service.render(data[2]))
+        await asyncio.sleep(0.05)
+        tasks[2].cancel()
+        await asyncio.sleep(0.05)
+        gate.set()
+        try:
+            # the coalesced request queues the render again
+            result = await asyncio.wait_for(coalesced, 5)
+            results = await asyncio.gather(*tasks[:2])
+        finally:
+            gate.set()
+        stats = service.stats()
+        await service.close()
+        return result, results, stats
+
+    result, results, stats = run(go())
+    assert result[:4] == b'MThd'
+    assert all(r[:4] == b'MThd' for r in results)
+    assert stats['rendered'] == 3
+
+
+def test_render_on_consecutive_loops():
+    service = SonificationService(ThreadPoolExecutor(1), max_workers=1)
+    data = np.random.rand(10)
+    # e.g. two asyncio.run calls: the second loop gets its own workers
+    first = run(asyncio.wait_for(service.render(data), 5))
+    second = run(asyncio.wait_for(service.render(data, key='D'), 5))
+    assert first[:4] == second[:4] == b'MThd'
+    run(service.close())
+
+
+def test_request_key():
+    velocity = np.zeros(5000)
+    other = velocity.copy()
+    other[2500] = 1
+    data = np.random.rand(5000)
+    assert (request_key(data, {'velocity': velocity}) !=
+            request_key(data, {'velocity': other}))
+    assert (request_key(data, {'velocity': velocity}) ==
+            request_key(data.copy(), {'velocity': velocity.copy()}))
+
+    structured = np.zeros(4, dtype=[('pitch', 'f8'), ('velocity', 'f8')])
+    assert request_series(structured).dtype.names == ('pitch', 'velocity')
+    pyramid = Pyramid.from_series(data)
+    assert request_series(pyramid) is pyramid
+    assert (request_key(pyramid, {}) !=
+            request_key(Pyramid.from_series(data[::-1]), {}))
+
+
+def test_http_server():
+
+    service = SonificationService(ThreadPoolExecutor(1), max_workers=1)
+
+    async def request(port, method, path, body=b''):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(('%s %s HTTP/1.0\r\nContent-Length: %d\r\n\r\n' % (
+            method, path, len(body))).encode('ascii') + body)
+        response = await reader.read()
+        writer.close()
+        head, _, payload = response.partition(b'\r\n\r\n')
+        return int(head.split()[1]), payload
+
+    async def go():
+        server = await serve(service, port=0)
+        port = server.sockets[0].getsockname()[1]
+        body = json.dumps({'series': [1, 2, 3, 4], 'mode': 'minor'})
+        midi = await request(port, 'POST', '/render', body.encode('utf-8'))
+        stats = await request(port, 'GET', '/stats')
+        missing = await request(port, 'GET', '/nope')
+        server.close()
+        await server.wait_closed()
+        await service.close()
+        return midi, stats, missing
+
+    midi, stats, missing = run(go())
+    assert midi[0] == 200 and midi[1][:4] == b'MThd'
+    assert stats[0] == 200 and json.loads(stats[1].decode('utf-8'))['rendered'] == 1
+    assert missing[0] == 404
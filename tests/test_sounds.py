@@ -1,9 +1,14 @@
 #!/usr/bin/env python
 
 import numpy as np
+import pytest
 
 
-from DataSounds.sounds import build_scale, note_number, note_name, get_music
+from DataSounds.sounds import (build_scale, note_number, note_name, get_music,
+                               note_array, scale_values, scale_pitches,
+                               run_starts, timestamp_ticks, stft,
+                               spectral_notes, get_spectral_music)
+from DataSounds.pyramid import Pyramid
 
 
 def test_build_scale_major():
@@ -46,3 +51,181 @@ def test_get_music():
                   octaves=2, instruments=inst[i]))
     assert len(testMuz[0].getvalue()) == 281
     assert len(testMuz[1].getvalue()) == 314
+
+
+def test_get_music_target_notes():
+    series = np.random.rand(1000)
+    pyramid = Pyramid.from_series(series)
+    assert len(pyramid.series(100)) == 63
+    from_array = get_music(series, target_notes=100).getvalue()
+    assert from_array == get_music(pyramid, target_notes=100).getvalue()
+    assert from_array == get_music(series, target_duration=50).getvalue()
+
+
+def test_pyramid_levels(tmpdir):
+    series = np.arange(10.)
+    series[3] = np.nan
+    pyramid = Pyramid.from_chunks([series[:3], series[3:]], factor=2)
+    mins, maxs, means, counts = pyramid.levels[0]
+    assert all(mins == [0, 2, 4, 6, 8])
+    assert all(maxs == [1, 2, 5, 7, 9])
+    assert all(means == [0.5, 2, 4.5, 6.5, 8.5])
+    assert [len(level[0]) for level in pyramid.levels] == [5, 3, 2, 1]
+
+    path = str(tmpdir.join('pyramid.npz'))
+    pyramid.save(path)
+    assert all(Pyramid.load(path).series(3, 'max') == [2, 7, 9])
+
+
+def test_scale_pitches():
+    assert list(scale_pitches(build_scale('C', 'major', 1))) == [
+        48, 50, 52, 53, 55, 57, 59]
+    # accidentals don't change the octave
+    assert list(scale_pitches(['c', 'cb', "b#'", 'fx', "ebb''"])) == [
+        48, 47, 72, 55, 74]
+
+
+def test_scale_values():
+    values = scale_values([0, 5, np.nan, 10], 32, 127)
+    assert all(values[[0, 1, 3]] == [32, 80, 127])
+    assert np.isnan(values[2])
+
+
+def test_note_array():
+    scale = build_scale('C', 'major', 1)
+    assert all(scale_pitches(scale) == [48, 50, 52, 53, 55, 57, 59])
+    track = note_array([0, np.nan, 2], scale, velocity=[10, 20, 30],
+                       duration=[8, 32, np.nan])
+    assert all(track.offset == [0, 40])
+    assert all(track.pitch == [48, 52])
+    assert all(track.duration == [8, 16])
+    assert all(track.velocity == [10, 30])
+
+
+def test_get_music_data_channels():
+    data = np.zeros(12, dtype=[('pitch', 'f8'), ('velocity', 'f8'),
+                               ('duration', 'f8'), ('instrument', 'f8')])
+    for field in data.dtype.names:
+        data[field] = np.random.rand(12)
+    kwargs = dict(velocity=data['velocity'], duration=data['duration'],
+                  instrument=data['instrument'], programs=[0, 40])
+    midi = get_music(data['pitch'], **kwargs).getvalue()
+    assert midi == get_music(data, programs=[0, 40]).getvalue()
+    assert midi != get_music(data['pitch']).getvalue()
+    assert b'\xc0\x28' in midi
+
+
+def test_get_music_pyramid_channels():
+    x = np.random.rand(1000)
+    pyramid = Pyramid.from_series(x)
+    # channels are reduced to the level of the series
+    reduced = pyramid.series()
+    assert (get_music(pyramid, velocity=x).getvalue() ==
+            get_music(reduced, velocity=reduced).getvalue())
+
+    pyramid = Pyramid.from_series(x, factor=4)
+    reduced = pyramid.series(60)
+    assert (get_music(pyramid, velocity=x, target_notes=60).getvalue() ==
+            get_music(reduced, velocity=reduced).getvalue())
+
+    # each row keeps its own level; channel rows are cut to their series
+    velocity = np.random.rand(2, 1000)
+    pyramids = [Pyramid.from_series(x), Pyramid.from_series(x[:300])]
+    rows = [[p.series(200) for p in pyramids],
+            [Pyramid.from_series(velocity[0]).series(200),
+             Pyramid.from_series(velocity[1, :300]).series(200)]]
+    assert [len(row) for row in rows[1]] == [125, 150]
+    series, velocity_rows = np.empty((2, 2, 150)) * np.nan
+    for i in range(2):
+        series[i, :len(rows[0][i])] = rows[0][i]
+        velocity_rows[i, :len(rows[1][i])] = rows[1][i]
+    assert (get_music(pyramids, velocity=velocity, target_notes=200)
+            .getvalue() ==
+            get_music(series, velocity=velocity_rows).getvalue())
+
+
+def test_velocity_range():
+    series = np.random.rand(10)
+    for velocity_range in [(0, 200), (-1, 100), (100, 90)]:
+        with pytest.raises(ValueError):
+            get_music(series, velocity=series, velocity_range=velocity_range)
+        with pytest.raises(ValueError):
+            get_spectral_music(series, window=64,
+                               velocity_range=velocity_range)
+
+
+def test_run_starts():
+    starts = run_starts([1, 1, np.nan, np.nan, 2, 2, 1])
+    assert list(starts) == [0, 2, 4, 6]
+    assert list(run_starts([1, 1, 1], [0, 1, 1])) == [0, 1]
+
+
+def test_note_array_coalesce():
+    scale = build_scale('C', 'major', 1)
+    track = note_array([0, 0, np.nan, np.nan, 2, 0], scale,
+                       velocity=[10, 20, 30, 40, 50, 60], coalesce=True)
+    assert all(track.offset == [0, 64, 80])
+    assert all(track.duration == [32, 16, 16])
+    assert all(track.pitch == [48, 52, 48])
+    assert all(track.velocity == [10, 50, 60])
+
+    series = np.repeat(np.random.rand(10), 5)
+    coalesced = get_music(series, coalesce=True).getvalue()
+    assert len(coalesced) < len(get_music(series).getvalue()) / 3
+
+
+def test_timestamp_ticks():
+    assert list(timestamp_ticks([0, 1, 2, 5])) == [0, 16, 32, 80]
+    assert list(timestamp_ticks([10, 11, 13], 480, beat=1)) == [0, 480, 1440]
+    days = np.array(['2016-01-01', '2016-01-02', '2016-01-04'],
+                    dtype='datetime64[D]')
+    assert list(timestamp_ticks(days, beat=86400)) == [0, 16, 48]
+
+
+def test_get_music_timestamps():
+    series = np.random.rand(20)
+    regular = get_music(series).getvalue()
+    assert get_music(series, timestamps=np.arange(20) * 3.).getvalue() == regular
+
+    scale = build_scale('C', 'major', 1)
+    track = note_array([0, 1, 2], scale, ticks=[0, 480, 2400], division=480)
+    assert all(track.offset == [0, 480, 2400])
+    assert all(track.duration == [480, 1920, 480])
+    assert track.division == 480
+    assert track.to_sequence()[1].tuple('offset_64', 'duration_64') == (16, 64)
+
+
+def test_get_music_pyramid_timestamps():
+    x = np.random.rand(1000)
+    t = np.arange(1000) * 3.
+    pyramid = Pyramid.from_series(x)
+    # buckets start at the first timestamp of the level of the series
+    assert (get_music(pyramid, timestamps=t).getvalue() ==
+            get_music(pyramid.series(), timestamps=t[::2]).getvalue())
+    assert (get_music(pyramid, timestamps=t, target_notes=100).getvalue() ==
+            get_music(pyramid.series(100), timestamps=t[::16]).getvalue())
+
+
+def test_stft_chunks():
+    t = np.arange(1000)
+    series = np.sin(t / 5.) + np.sin(t / 17.)
+    whole = np.concatenate(list(stft([series], window=64, hop=16)))
+    chunks = (series[i:i + 37] for i in range(0, len(series), 37))
+    assert np.allclose(np.concatenate(list(stft(chunks, 64, 16))), whole)
+    # the last 8 samples get a padded window of their own
+    assert whole.shape == ((1000 - 64) // 16 + 2, 33)
+
+
+def test_spectral_notes():
+    # 8 periods per window fall in the 4th of 14 bands
+    t = np.arange(64 * 20)
+    series = np.sin(2 * np.pi * t * 8 / 64.) * np.repeat([1, 4], 640)
+    series[:64] = np.nan
+    track = spectral_notes(series, window=64, hop=64, voices=1)
+    assert list(track.offset) == list(np.arange(1, 20) * 16)
+    assert (track.pitch == scale_pitches(build_scale('C', 'major', 2))[3]).all()
+    assert track.velocity[0] == 32 and track.velocity[-1] == 127
+
+    chords = spectral_notes(series, window=64, voices=3)
+    assert len(chords) == 3 * (len(series) // 32 - 2)
+    assert get_spectral_music(np.vstack([series, series]), window=64).getvalue()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+
+import struct
+from io import BytesIO
+
+from DataSounds.external.sebastian.midi.write_midi import (
+    SMF, allocate_channels, PERCUSSION_CHANNEL)
+from DataSounds.notearray import NoteArray
+
+
+def read_varlen(data, pos):
+    value = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value = (value << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            return value, pos
+
+
+def read_tracks(data):
+    '''
+    Decode the MIDI files written by SMF into lists of
+    (tick, status, data) events per track.
+    '''
+    data = bytearray(data)
+    assert data[:4] == b'MThd'
+    pos = 14
+    tracks = []
+    while pos < len(data):
+        assert data[pos:pos + 4] == b'MTrk'
+        length, = struct.unpack('>I', bytes(data[pos + 4:pos + 8]))
+        pos += 8
+        end = pos + length
+        tick = 0
+        events = []
+        while pos < end:
+            delta, pos = read_varlen(data, pos)
+            tick += delta
+            status = data[pos]
+            if status == 0xFF:
+                size, start = read_varlen(data, pos + 2)
+                events.append((tick, status, bytes(data[pos + 1:start + size])))
+                pos = start + size
+            elif status & 0xF0 == 0xC0:
+                events.append((tick, status, bytes(data[pos + 1:pos + 2])))
+                pos += 2
+            else:
+                events.append((tick, status, bytes(data[pos + 1:pos + 3])))
+                pos += 3
+        tracks.append(events)
+    return tracks
+
+
+def melody():
+    return NoteArray([0, 16, 32], [60, 62, 64], [16, 16, 16])
+
+
+def test_allocate_channels_skips_percussion():
+    channels, shared = allocate_channels(list(range(15)))
+    assert PERCUSSION_CHANNEL not in channels
+    assert len(set(channels)) == 15
+    assert not shared
+
+
+def test_allocate_channels_packs_instruments():
+    keys = [0, 40, 0, 40] * 10
+    channels, shared = allocate_channels(keys)
+    assert channels[:4] == [0, 1, 0, 1]
+    assert set(channels) == set([0, 1])
+    assert not shared
+
+    channels, shared = allocate_channels(list(range(20)))
+    assert max(channels) == 15
+    assert PERCUSSION_CHANNEL not in channels
+    assert shared == set(channels[15:])
+
+
+def test_write_many_tracks():
+    tracks = [melody() for _ in range(40)]
+    out = BytesIO()
+    SMF(tracks, instruments=list(range(40))).write(out)
+    decoded = read_tracks(out.getvalue())
+    assert len(decoded) == 41
+    for events in decoded[1:]:
+        for tick, status, data in events:
+            if status != 0xFF:
+                assert status & 0x0F != PERCUSSION_CHANNEL
+    # channels shared by different instruments set the program per note
+    programs = [e for e in decoded[-1] if e[1] & 0xF0 == 0xC0]
+    assert len(programs) == 4
+
+
+def test_write_format_0():
+    out = BytesIO()
+    SMF([melody(), melody()], instruments=[0, 40]).write(out, format=0)
+    decoded = read_tracks(out.getvalue())
+    assert len(decoded) == 1
+    events = decoded[0]
+    assert [e[0] for e in events] == sorted(e[0] for e in events)
+    assert (0, 0xC0, b'\x00') in events
+    assert (0, 0xC1, b'\x28') in events
+    assert len([e for e in events if e[1] & 0xF0 == 0x90]) == 6
+
+
+def test_format_0_packed_channel():
+    # two tracks handing the same pitch back and forth, packed on one
+    # channel with 14 silent tracks of the same instrument
+    tracks = [NoteArray([0, 32], [60, 60], [16, 16]),
+              NoteArray([16, 48], [60, 60], [16, 16])]
+    tracks += [NoteArray([], [], []) for _ in range(14)]
+    out = BytesIO()
+    SMF(tracks).write(out, format=0)
+    events = [(tick, status) for tick, status, data
+              in read_tracks(out.getvalue())[0] if status & 0xF0 in (0x80, 0x90)]
+    assert events == [(0, 0x90), (16, 0x80), (16, 0x90), (32, 0x80),
+                      (32, 0x90), (48, 0x80), (48, 0x90), (64, 0x80)]
+
+
+def test_event_order():
+    # a zero length note, a note ending as the next one starts and a rest
+    track = NoteArray([0, 0, 16, 48], [60, 62, 64, 65], [0, 16, 16, 16])
+    out = BytesIO()
+    SMF([track]).write(out)
+    events = [(tick, status, bytearray(data)[0]) for tick, status, data
+              in read_tracks(out.getvalue())[1] if status != 0xFF]
+    assert events == [(0, 0xC0, 0),
+                      (0, 0x90, 60), (0, 0x80, 60), (0, 0x90, 62),
+                      (16, 0x80, 62), (16, 0x90, 64), (32, 0x80, 64),
+                      (48, 0x90, 65), (64, 0x80, 65)]
+
+
+def test_velocity_clipped():
+    track = NoteArray([0, 16], [60, 62], [16, 16], [200, -5])
+    out = BytesIO()
+    SMF([track]).write(out)
+    velocities = [bytearray(data)[1] for _, status, data
+                  in read_tracks(out.getvalue())[1] if status == 0x90]
+    assert velocities == [127, 0]
+
+
+def test_leading_rest():
+    out = BytesIO()
+    SMF([NoteArray([32], [60], [16])]).write(out)
+    events = read_tracks(out.getvalue())[1]
+    assert (32, 0x90, b'\x3c\x40') in events
+
+
+def test_long_deltas():
+    track = NoteArray([0, 300000], [60, 61], [20000, 16])
+    out = BytesIO()
+    SMF([track]).write(out)
+    ticks = [e[0] for e in read_tracks(out.getvalue())[1] if e[1] != 0xFF]
+    assert ticks == [0, 0, 20000, 300000, 300016]